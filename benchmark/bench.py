@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import types
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from stub_server import add_server_arguments, server_options  # noqa: E402
+
+# 测量 上传 → 提交 → 等待 → 下载 整条流水线：每种负载单独启动一个模拟服务器和一个客户端进程，
+# 峰值内存只统计客户端
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WORKLOADS = {
+    "image": {
+        "workflow": {
+            "1": {"class_type": "LoadImage", "inputs": {"image": "input.png"}},
+            "2": {"class_type": "SaveImage", "inputs": {"images": ["1", 0], "filename_prefix": "bench"}},
+        },
+        "selected": {"1": "image"},
+    },
+    "audio": {
+        "workflow": {
+            "1": {"class_type": "LoadAudio", "inputs": {"audio": "input.wav"}},
+            "2": {"class_type": "SaveAudio", "inputs": {"audio": ["1", 0], "filename_prefix": "bench"}},
+        },
+        "selected": {"1": "audio"},
+    },
+    "video": {
+        "workflow": {
+            "1": {"class_type": "VHS_LoadVideo", "inputs": {"video": "input.mp4"}},
+            "2": {"class_type": "VHS_VideoCombine", "inputs": {"images": ["1", 0], "frame_rate": 24, "format": "video/h264-mp4"}},
+        },
+        "selected": {"1": "video"},
+    },
+}
+
+
+def install_comfy_shims():
+    # 不在 ComfyUI 环境中运行时，只提供节点模块导入时用到的 folder_paths 目录函数
+    try:
+        import folder_paths  # noqa: F401
+        return
+    except ImportError:
+        pass
+    base = tempfile.mkdtemp(prefix="pond_bench_")
+    shim = types.ModuleType("folder_paths")
+    for name in ("get_temp_directory", "get_user_directory", "get_input_directory", "get_output_directory"):
+        setattr(shim, name, lambda base=base: base)
+    sys.modules["folder_paths"] = shim
+
+
+def load_node_module():
+    install_comfy_shims()
+    spec = importlib.util.spec_from_file_location("remote_workflow_node", os.path.join(REPO_ROOT, "remote_workflow_node.py"))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["remote_workflow_node"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux 以 KB 为单位，macOS 以字节为单位
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(fraction * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def make_inputs(torch, workload, args, index):
+    # 每个任务的输入内容不同，避免上传缓存掩盖上传耗时
+    generator = torch.Generator().manual_seed(index)
+    size = args.input_size
+    if workload == "image":
+        return {"image_1": torch.rand(1, size, size, 3, generator=generator)}
+    if workload == "audio":
+        samples = int(args.audio_input_seconds * 44100)
+        waveform = torch.rand(1, 2, samples, generator=generator) * 2 - 1
+        return {"audio_1": {"waveform": waveform, "sample_rate": 44100}}
+    return {"video_1": torch.rand(args.video_input_frames, size, size, 3, generator=generator)}
+
+
+def run_worker(args):
+    module = load_node_module()
+    import torch
+
+    workload = args.worker
+    if workload == "video" and module.find_ffmpeg() is None:
+        print(json.dumps({"workload": workload, "skipped": "ffmpeg not found"}))
+        return
+
+    spec = WORKLOADS[workload]
+    host, port = args.server.rsplit(":", 1)
+    workflow_file = json.dumps(spec["workflow"])
+    selected_nodes = json.dumps(spec["selected"])
+    options = {
+        "image_format": args.image_format,
+        "audio_format": args.audio_format,
+        "video_codec": args.video_codec,
+    }
+
+    async def run_jobs(first, count):
+        semaphore = asyncio.Semaphore(max(1, args.concurrency))
+
+        async def run_one(index):
+            async with semaphore:
+                node = module.RemoteWorkflowExecutor()
+                inputs = make_inputs(torch, workload, args, index)
+                started = time.perf_counter()
+                outputs = await node.execute_remote_async(host, int(port), workflow_file, selected_nodes, "{}", **options, **inputs)
+                elapsed = time.perf_counter() - started
+                report = node.last_run_report
+                ok = report is not None and report.prompt_id is not None and "outputs" in report.phases
+                return ok, elapsed, report, outputs[1]
+
+        return await asyncio.gather(*(run_one(index) for index in range(first, first + count)))
+
+    rss_baseline = peak_rss_mb()
+    if args.warmup:
+        module.remote_engine.run(run_jobs(0, args.warmup))
+
+    started = time.perf_counter()
+    results = module.remote_engine.run(run_jobs(args.warmup, args.jobs))
+    wall = time.perf_counter() - started
+
+    phases = {}
+    errors = []
+    for ok, elapsed, report, message in results:
+        if not ok:
+            errors.append(message)
+            continue
+        for phase, seconds in report.phases.items():
+            phases.setdefault(phase, []).append(seconds)
+        phases.setdefault("total", []).append(elapsed)
+
+    completed = len(results) - len(errors)
+    print(json.dumps({
+        "workload": workload,
+        "jobs": len(results),
+        "failed": len(errors),
+        "errors": sorted(set(errors))[:5],
+        "concurrency": args.concurrency,
+        "wall_seconds": wall,
+        "jobs_per_second": completed / wall if wall > 0 else None,
+        "phases": {
+            phase: {"p50": percentile(values, 0.5), "p99": percentile(values, 0.99), "count": len(values)}
+            for phase, values in phases.items()
+        },
+        "rss_baseline_mb": rss_baseline,
+        "rss_peak_mb": peak_rss_mb(),
+    }))
+
+
+def start_stub(args):
+    command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "stub_server.py"), "--port", "0"]
+    for name, value in server_options(args).items():
+        command += [f"--{name.replace('_', '-')}", str(value)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline().strip()
+    if not line.startswith("listening on "):
+        process.kill()
+        raise RuntimeError(f"stub server failed to start: {line}")
+    return process, line[len("listening on "):]
+
+
+def run_workload(args, workload):
+    stub = None
+    server = args.server
+    if server is None:
+        stub, server = start_stub(args)
+    try:
+        command = [sys.executable, os.path.abspath(__file__), "--worker", workload, "--server", server]
+        for name in ("jobs", "warmup", "concurrency", "input_size", "audio_input_seconds", "video_input_frames",
+                     "image_format", "audio_format", "video_codec"):
+            command += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+        result = subprocess.run(command, stdout=subprocess.PIPE, text=True)
+        lines = result.stdout.strip().splitlines()
+        if result.returncode != 0 or not lines:
+            return {"workload": workload, "skipped": f"worker exited with {result.returncode}"}
+        return json.loads(lines[-1])
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+
+
+def format_ms(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}"
+
+
+def print_result(result):
+    if "skipped" in result:
+        print(f"== {result['workload']}: skipped ({result['skipped']})")
+        return
+    rate = result["jobs_per_second"]
+    rss = result["rss_peak_mb"]
+    print(
+        f"== {result['workload']}: {result['jobs']} jobs, {result['failed']} failed, concurrency {result['concurrency']}, "
+        f"{rate:.2f} jobs/s, peak RSS {'-' if rss is None else f'{rss:.1f} MB'}"
+    )
+    for message in result["errors"]:
+        print(f"   error: {message}")
+    print(f"   {'phase':<12}{'p50 ms':>10}{'p99 ms':>10}")
+    for phase, stats in result["phases"].items():
+        print(f"   {phase:<12}{format_ms(stats['p50']):>10}{format_ms(stats['p99']):>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="RemoteWorkflowExecutor 性能测试")
+    parser.add_argument("--workloads", default="image,audio,video", help="逗号分隔：image、audio、video")
+    parser.add_argument("--server", default=None, help="使用已有的服务器 host:port，不启动模拟服务器")
+    parser.add_argument("--jobs", type=int, default=20, help="计入统计的任务数")
+    parser.add_argument("--warmup", type=int, default=2, help="预热任务数（建立连接、探测服务器），不计入统计")
+    parser.add_argument("--concurrency", type=int, default=1, help="同时执行的任务数")
+    parser.add_argument("--input-size", type=int, default=512, help="图像/视频输入的边长")
+    parser.add_argument("--audio-input-seconds", type=float, default=5.0, help="音频输入时长（秒）")
+    parser.add_argument("--video-input-frames", type=int, default=24, help="视频输入帧数")
+    parser.add_argument("--image-format", default="auto")
+    parser.add_argument("--audio-format", default="wav")
+    parser.add_argument("--video-codec", default="mp4_lossless")
+    parser.add_argument("--json", default=None, help="把结果写入 JSON 文件")
+    parser.add_argument("--worker", default=None, help=argparse.SUPPRESS)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    if args.worker:
+        run_worker(args)
+        return
+
+    results = []
+    for workload in [name.strip() for name in args.workloads.split(",") if name.strip()]:
+        if workload not in WORKLOADS:
+            parser.error(f"unknown workload: {workload}")
+        result = run_workload(args, workload)
+        print_result(result)
+        results.append(result)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,428 @@
+import argparse
+import base64
+import hashlib
+import io
+import json
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import threading
+import time
+import uuid
+import wave
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+from PIL import Image
+
+# 模拟远程 ComfyUI：不运行模型，按参数生成固定大小的输出，并按脚本发送 WebSocket 事件
+
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+
+NODE_CLASSES = [
+    "LoadImage", "LoadAudio", "LoadVideo", "VHS_LoadVideo", "VHS_LoadImages",
+    "SaveImage", "PreviewImage", "SaveAudio", "PreviewAudio", "VHS_VideoCombine",
+    "CR Prompt Text",
+]
+
+IMAGE_OUTPUT_NODES = ("SaveImage", "PreviewImage")
+AUDIO_OUTPUT_NODES = ("SaveAudio", "PreviewAudio")
+VIDEO_OUTPUT_NODES = ("VHS_VideoCombine",)
+
+
+def find_ffmpeg():
+    path = os.environ.get("POND_REMOTE_FFMPEG") or shutil.which("ffmpeg")
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def make_image_bytes(size, seed):
+    # 随机噪声几乎不可压缩，相当于输出大小的上限
+    rng = np.random.default_rng(seed)
+    buffer = io.BytesIO()
+    Image.fromarray(rng.integers(0, 256, (size, size, 3), dtype=np.uint8)).save(buffer, format="PNG", compress_level=1)
+    return buffer.getvalue()
+
+
+def make_audio_bytes(seconds, sample_rate=44100):
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    samples = np.stack([np.sin(2 * np.pi * 440 * t), np.sin(2 * np.pi * 220 * t)], axis=1) * 0.5
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as writer:
+        writer.setnchannels(2)
+        writer.setsampwidth(2)
+        writer.setframerate(sample_rate)
+        writer.writeframes((samples * 32767).astype("<i2").tobytes())
+    return buffer.getvalue()
+
+
+def make_video_bytes(frames, size, fps=24):
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None or frames <= 0:
+        return None
+    result = subprocess.run(
+        [ffmpeg, "-v", "error",
+         "-f", "lavfi", "-i", f"testsrc=size={size}x{size}:rate={fps}",
+         "-f", "lavfi", "-i", "sine=frequency=440",
+         "-frames:v", str(frames), "-c:v", "libx264", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest",
+         "-movflags", "frag_keyframe+empty_moov", "-f", "mp4", "pipe:1"],
+        stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=120
+    )
+    return result.stdout if result.returncode == 0 and result.stdout else None
+
+
+def ws_send(sock, text):
+    data = text.encode()
+    header = bytes([0x81])
+    if len(data) < 126:
+        header += bytes([len(data)])
+    elif len(data) < 65536:
+        header += bytes([126]) + struct.pack(">H", len(data))
+    else:
+        header += bytes([127]) + struct.pack(">Q", len(data))
+    sock.sendall(header + data)
+
+
+class StubState:
+
+    def __init__(self, latency=0.0, bandwidth=0.0, exec_time=0.2, progress_steps=5,
+                 images=1, image_size=512, audio_seconds=5.0, video_frames=48, video_size=512):
+        self.latency = latency
+        self.bandwidth = bandwidth * 1024 * 1024
+        self.exec_time = exec_time
+        self.progress_steps = max(1, progress_steps)
+        self.lock = threading.Lock()
+        self.files = {}
+        self.history = {}
+        self.clients = {}
+        self.running = set()
+        self.interrupted = set()
+        self.counters = {"uploads": 0, "upload_bytes": 0, "prompts": 0, "view_bytes": 0}
+        self.image_outputs = [make_image_bytes(image_size, seed) for seed in range(images)]
+        self.audio_output = make_audio_bytes(audio_seconds)
+        self.video_output = make_video_bytes(video_frames, video_size)
+
+    def throttle(self, nbytes, started):
+        if self.bandwidth > 0:
+            remaining = nbytes / self.bandwidth - (time.perf_counter() - started)
+            if remaining > 0:
+                time.sleep(remaining)
+
+
+def make_handler(state):
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        # 响应头和正文分两次写出，不关闭 Nagle 时每个请求会多出约 40ms 的延迟确认
+        disable_nagle_algorithm = True
+
+        def log_message(self, *args):
+            pass
+
+        def _json(self, obj, code=200):
+            body = json.dumps(obj).encode()
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _empty(self, code):
+            self.send_response(code)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+
+        def _read_body(self):
+            started = time.perf_counter()
+            if self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+                parts = []
+                while True:
+                    size = int(self.rfile.readline().strip(), 16)
+                    if size == 0:
+                        self.rfile.readline()
+                        break
+                    parts.append(self.rfile.read(size))
+                    self.rfile.readline()
+                body = b"".join(parts)
+            else:
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            state.throttle(len(body), started)
+            return body
+
+        def _view_key(self, query):
+            return (query.get("subfolder", [""])[0], query.get("filename", [""])[0])
+
+        def do_HEAD(self):
+            url = urlparse(self.path)
+            if state.latency:
+                time.sleep(state.latency)
+            data = state.files.get(self._view_key(parse_qs(url.query))) if url.path == "/view" else None
+            if data is None:
+                return self._empty(404)
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            if url.path == "/ws":
+                return self._websocket(query.get("clientId", [""])[0])
+            if state.latency:
+                time.sleep(state.latency)
+
+            if url.path == "/system_stats":
+                return self._json({"system": {}, "devices": [{"name": "stub", "type": "cpu", "vram_total": 0, "vram_free": 0}]})
+            if url.path == "/object_info":
+                return self._json({name: {} for name in NODE_CLASSES})
+            if url.path == "/queue":
+                with state.lock:
+                    running = list(state.running)
+                return self._json({"queue_running": [[0, pid, {}, {}, []] for pid in running], "queue_pending": []})
+            if url.path.startswith("/history/"):
+                prompt_id = url.path.rsplit("/", 1)[-1]
+                with state.lock:
+                    entry = state.history.get(prompt_id)
+                return self._json({prompt_id: entry} if entry else {})
+            if url.path == "/view":
+                return self._view(query)
+            self._json({}, 404)
+
+        def _view(self, query):
+            data = state.files.get(self._view_key(query))
+            if data is None:
+                return self._empty(404)
+
+            start = 0
+            byte_range = self.headers.get("Range", "")
+            if byte_range.startswith("bytes="):
+                start = min(int(byte_range[6:].split("-")[0] or 0), len(data))
+                self.send_response(206)
+                self.send_header("Content-Range", f"bytes {start}-{len(data) - 1}/{len(data)}")
+            else:
+                self.send_response(200)
+            self.send_header("Content-Length", str(len(data) - start))
+            self.end_headers()
+
+            started = time.perf_counter()
+            sent = 0
+            view = memoryview(data)[start:]
+            for offset in range(0, len(view), 1 << 16):
+                chunk = view[offset:offset + (1 << 16)]
+                self.wfile.write(chunk)
+                sent += len(chunk)
+                state.throttle(sent, started)
+            with state.lock:
+                state.counters["view_bytes"] += sent
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if state.latency:
+                time.sleep(state.latency)
+            body = self._read_body()
+
+            if url.path in ("/upload/image", "/upload/audio"):
+                return self._upload(body)
+            if url.path == "/prompt":
+                request = json.loads(body)
+                prompt_id = str(uuid.uuid4())
+                with state.lock:
+                    state.counters["prompts"] += 1
+                threading.Thread(target=run_prompt, args=(state, prompt_id, request), daemon=True).start()
+                return self._json({"prompt_id": prompt_id, "number": state.counters["prompts"]})
+            if url.path == "/interrupt":
+                request = json.loads(body or b"{}")
+                with state.lock:
+                    state.interrupted.update([request["prompt_id"]] if request.get("prompt_id") else state.running)
+                return self._json({})
+            if url.path == "/queue":
+                return self._json({})
+            self._json({}, 404)
+
+        def _upload(self, body):
+            boundary = self.headers["Content-Type"].split("boundary=")[1].encode()
+            filename, content, fields = None, b"", {}
+            for part in body.split(b"--" + boundary):
+                if b"\r\n\r\n" not in part:
+                    continue
+                head, value = part.split(b"\r\n\r\n", 1)
+                head = head.decode(errors="ignore")
+                value = value[:-2]
+                if 'filename="' in head:
+                    filename = head.split('filename="')[1].split('"')[0]
+                    content = value
+                elif 'name="' in head:
+                    fields[head.split('name="')[1].split('"')[0]] = value.decode(errors="ignore")
+
+            subfolder = fields.get("subfolder", "")
+            with state.lock:
+                state.files[(subfolder, filename)] = content
+                state.counters["uploads"] += 1
+                state.counters["upload_bytes"] += len(content)
+            self._json({"name": filename, "subfolder": subfolder, "type": "input"})
+
+        def _websocket(self, client_id):
+            key = self.headers["Sec-WebSocket-Key"]
+            accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode()).digest()).decode()
+            self.send_response(101)
+            self.send_header("Upgrade", "websocket")
+            self.send_header("Connection", "Upgrade")
+            self.send_header("Sec-WebSocket-Accept", accept)
+            self.end_headers()
+            self.wfile.flush()
+
+            sock = self.connection
+            with state.lock:
+                state.clients[client_id] = sock
+            ws_send(sock, json.dumps({"type": "status", "data": {"sid": client_id}}))
+            try:
+                while True:
+                    header = sock.recv(2)
+                    if len(header) < 2:
+                        break
+                    opcode = header[0] & 0x0F
+                    length = header[1] & 0x7F
+                    if length == 126:
+                        length = struct.unpack(">H", sock.recv(2))[0]
+                    elif length == 127:
+                        length = struct.unpack(">Q", sock.recv(8))[0]
+                    if header[1] & 0x80:
+                        sock.recv(4)
+                    remaining = length
+                    while remaining > 0:
+                        chunk = sock.recv(remaining)
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                    if opcode == 8:
+                        break
+            except OSError:
+                pass
+            with state.lock:
+                if state.clients.get(client_id) is sock:
+                    del state.clients[client_id]
+            self.close_connection = True
+
+    return StubHandler
+
+
+def run_prompt(state, prompt_id, request):
+    client_id = request.get("client_id")
+
+    def send(msg_type, data):
+        with state.lock:
+            sock = state.clients.get(client_id)
+        if sock is not None:
+            try:
+                ws_send(sock, json.dumps({"type": msg_type, "data": dict(data, prompt_id=prompt_id)}))
+            except OSError:
+                pass
+
+    with state.lock:
+        state.running.add(prompt_id)
+    send("execution_start", {})
+
+    outputs = {}
+    nodes = sorted(request["prompt"].items(), key=lambda item: int(item[0]) if item[0].isdigit() else 0)
+    for node_id, node in nodes:
+        class_type = node.get("class_type")
+        send("executing", {"node": node_id})
+        if class_type not in IMAGE_OUTPUT_NODES + AUDIO_OUTPUT_NODES + VIDEO_OUTPUT_NODES:
+            continue
+
+        for step in range(state.progress_steps):
+            time.sleep(state.exec_time / state.progress_steps)
+            if prompt_id in state.interrupted:
+                with state.lock:
+                    state.running.discard(prompt_id)
+                send("execution_interrupted", {"node_id": node_id})
+                return
+            send("progress", {"node": node_id, "value": step + 1, "max": state.progress_steps})
+
+        prefix = f"{prompt_id[:8]}_{node_id}"
+        if class_type in IMAGE_OUTPUT_NODES:
+            items = []
+            for index, data in enumerate(state.image_outputs):
+                filename = f"stub_{prefix}_{index}.png"
+                state.files[("", filename)] = data
+                items.append({"filename": filename, "subfolder": "", "type": "output"})
+            outputs[node_id] = {"images": items}
+        elif class_type in AUDIO_OUTPUT_NODES:
+            filename = f"stub_{prefix}.wav"
+            state.files[("", filename)] = state.audio_output
+            outputs[node_id] = {"audio": [{"filename": filename, "subfolder": "", "type": "output"}]}
+        elif state.video_output is not None:
+            filename = f"stub_{prefix}.mp4"
+            state.files[("", filename)] = state.video_output
+            outputs[node_id] = {"gifs": [{"filename": filename, "subfolder": "", "type": "output", "format": "video/h264-mp4"}]}
+        send("executed", {"node": node_id, "output": outputs.get(node_id, {})})
+
+    with state.lock:
+        state.running.discard(prompt_id)
+        state.history[prompt_id] = {"outputs": outputs, "status": {"status_str": "success", "completed": True}}
+    send("executing", {"node": None})
+
+
+def start_server(host="127.0.0.1", port=0, **options):
+    state = StubState(**options)
+    server = ThreadingHTTPServer((host, port), make_handler(state))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="stub_comfyui", daemon=True).start()
+    return server, state
+
+
+def add_server_arguments(parser):
+    parser.add_argument("--latency", type=float, default=0.0, help="每个 HTTP 请求的额外延迟（秒）")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="上传/下载带宽上限（MB/s），0 为不限")
+    parser.add_argument("--exec-time", type=float, default=0.2, help="每个输出节点的模拟执行时间（秒）")
+    parser.add_argument("--progress-steps", type=int, default=5, help="每个输出节点发送的 progress 事件数")
+    parser.add_argument("--images", type=int, default=1, help="每个图像输出节点输出的图像数")
+    parser.add_argument("--image-size", type=int, default=512, help="输出图像边长")
+    parser.add_argument("--audio-seconds", type=float, default=5.0, help="输出音频时长（秒）")
+    parser.add_argument("--video-frames", type=int, default=48, help="输出视频帧数，需要 ffmpeg")
+    parser.add_argument("--video-size", type=int, default=512, help="输出视频边长")
+
+
+def server_options(args):
+    return {
+        "latency": args.latency,
+        "bandwidth": args.bandwidth,
+        "exec_time": args.exec_time,
+        "progress_steps": args.progress_steps,
+        "images": args.images,
+        "image_size": args.image_size,
+        "audio_seconds": args.audio_seconds,
+        "video_frames": args.video_frames,
+        "video_size": args.video_size,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="用于性能测试的模拟 ComfyUI 服务器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8188)
+    add_server_arguments(parser)
+    args = parser.parse_args()
+
+    server, state = start_server(args.host, args.port, **server_options(args))
+    host, port = server.server_address[:2]
+    print(f"listening on {host}:{port}", flush=True)
+    if state.video_output is None and args.video_frames > 0:
+        print("ffmpeg not found, video outputs disabled", file=sys.stderr, flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,7 @@ app.registerExtension({
     name: "RemoteWorkflow.FileUploadSelector",
     
     async beforeRegisterNodeDef(nodeType, nodeData, app) {
-        if (nodeData.name === "RemoteWorkflowExecutor") {
+        if (nodeData.name === "RemoteWorkflowExecutor" || nodeData.name === "RemoteWorkflowSubmit") {
             const onNodeCreated = nodeType.prototype.onNodeCreated;
             
             nodeType.prototype.onNodeCreated = function() {
@@ -73,6 +73,9 @@ app.registerExtension({
                     const inputNodeTypes = {
                         "LoadImage": "image",
                         "LoadVideo": "video",
+                        "VHS_LoadVideo": "video",
+                        "VHS_LoadVideoFFmpeg": "video",
+                        "VHS_LoadImages": "video",
                         "LoadAudio": "audio",
                         "CR Prompt Text": "text",
                         "easy showAnything": "text",
@@ -248,7 +251,7 @@ app.registerExtension({
                     const ipInput = document.createElement("input");
                     ipInput.type = "text";
                     ipInput.value = ipWidget.value;
-                    ipInput.placeholder = "例如: 192.168.1.100";
+                    ipInput.placeholder = "例如: 192.168.1.100，多台服务器用逗号分隔";
                     ipInput.style.cssText = `
                         width: 100%;
                         padding: 12px;
@@ -725,7 +728,10 @@ app.registerExtension({
                         if (ipHidden) {
                             ipDisplay.textContent = `🌐 ***.***.***:****`;
                         } else {
-                            ipDisplay.textContent = `🌐 ${ipWidget.value}:${portWidget.value}`;
+                            const ipValue = String(ipWidget.value);
+                            ipDisplay.textContent = /[,;\s]/.test(ipValue.trim())
+                                ? `🌐 ${ipValue}`
+                                : `🌐 ${ipValue}:${portWidget.value}`;
                         }
                     }
                 };
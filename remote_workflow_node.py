@@ -1,20 +1,2488 @@
 import requests
 import json
+import asyncio
+import functools
+import logging
 import base64
+import contextlib
+import copy
+import hashlib
 import io
 import os
+import re
+import shutil
+import struct
+import subprocess
 import time
+import uuid
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import numpy as np
 from PIL import Image
 import torch
 import folder_paths
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+
+def _env_int(name, default):
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _env_float(name, default):
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+class RemoteConnectionManager:
+
+    DEFAULT_TIMEOUTS = {
+        "connect": 5,
+        "probe": 5,
+        "upload": 30,
+        "queue": 10,
+        "download": 30,
+    }
+
+    def __init__(self, pool_maxsize=None, retry_total=None, retry_backoff=None, timeouts=None):
+        self.pool_maxsize = pool_maxsize if pool_maxsize is not None else _env_int("POND_REMOTE_POOL_MAXSIZE", 16)
+        self.retry_total = retry_total if retry_total is not None else _env_int("POND_REMOTE_RETRY_TOTAL", 3)
+        self.retry_backoff = retry_backoff if retry_backoff is not None else _env_float("POND_REMOTE_RETRY_BACKOFF", 0.5)
+        self.timeouts = dict(self.DEFAULT_TIMEOUTS)
+        for phase in self.timeouts:
+            self.timeouts[phase] = _env_float(f"POND_REMOTE_TIMEOUT_{phase.upper()}", self.timeouts[phase])
+        if timeouts:
+            self.timeouts.update(timeouts)
+        self._sessions = {}
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def configure(self, pool_maxsize=None, retry_total=None, retry_backoff=None, timeouts=None):
+        with self._lock:
+            if pool_maxsize is not None:
+                self.pool_maxsize = pool_maxsize
+            if retry_total is not None:
+                self.retry_total = retry_total
+            if retry_backoff is not None:
+                self.retry_backoff = retry_backoff
+            if timeouts:
+                self.timeouts.update(timeouts)
+            sessions = list(self._sessions.values())
+            self._sessions.clear()
+        for session in sessions:
+            try:
+                session.close()
+            except:
+                pass
+
+    def _build_session(self):
+        # 连接错误对所有方法重试；读超时和 5xx 只对幂等的 GET/HEAD 重试，避免重复提交工作流
+        retry = Retry(
+            total=self.retry_total,
+            connect=self.retry_total,
+            read=self.retry_total,
+            status=self.retry_total,
+            backoff_factor=self.retry_backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset(["GET", "HEAD"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_maxsize,
+            max_retries=retry,
+        )
+        session = requests.Session()
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return session
+
+    def session(self, server_address):
+        with self._lock:
+            session = self._sessions.get(server_address)
+            if session is None:
+                session = self._build_session()
+                self._sessions[server_address] = session
+            return session
+
+    def timeout(self, phase):
+        return (self.timeouts["connect"], self.timeouts.get(phase, self.timeouts["download"]))
+
+    def ordered_routes(self, server_address, purpose, routes):
+        # 把该服务器上次成功的接口排在最前，避免每个任务都重复尝试失败的接口
+        with self._lock:
+            preferred = self._routes.get((server_address, purpose))
+        return sorted(routes, key=lambda route: route != preferred)
+
+    def remember_route(self, server_address, purpose, route):
+        with self._lock:
+            self._routes[(server_address, purpose)] = route
+
+    def close(self, server_address=None):
+        with self._lock:
+            if server_address is None:
+                sessions = list(self._sessions.values())
+                self._sessions.clear()
+                self._routes.clear()
+            else:
+                session = self._sessions.pop(server_address, None)
+                for key in [key for key in self._routes if key[0] == server_address]:
+                    del self._routes[key]
+                sessions = [session] if session is not None else []
+        for session in sessions:
+            try:
+                session.close()
+            except:
+                pass
+
+
+connection_manager = RemoteConnectionManager()
+
+def tensor_content_hash(tensor, *extra):
+    tensor = tensor.detach()
+    if tensor.device.type != "cpu":
+        tensor = tensor.cpu()
+    tensor = tensor.contiguous()
+    
+    digest = hashlib.sha256()
+    digest.update(str(tuple(tensor.shape)).encode())
+    digest.update(str(tensor.dtype).encode())
+    for item in extra:
+        digest.update(str(item).encode())
+    digest.update(tensor.reshape(-1).view(torch.uint8).numpy())
+    return digest.hexdigest()
+
+
+def derived_content_key(value_hash, *extra):
+    # 由上传计划中已算好的输入哈希派生上传缓存键，不必再对同一张量完整哈希一次
+    digest = hashlib.sha256(value_hash.encode())
+    for item in extra:
+        digest.update(str(item).encode())
+    return digest.hexdigest()
+
+
+class UploadCache:
+
+    def __init__(self, max_entries=None, verify_ttl=None, on_evict=None):
+        self.max_entries = max_entries if max_entries is not None else _env_int("POND_REMOTE_UPLOAD_CACHE_SIZE", 512)
+        self.verify_ttl = verify_ttl if verify_ttl is not None else _env_float("POND_REMOTE_UPLOAD_CACHE_TTL", 300)
+        self.on_evict = on_evict
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._upload_locks = [threading.Lock() for _ in range(64)]
+
+    def upload_lock(self, server_address, content_key):
+        # 同一内容同时上传时只让一个线程真正上传，其余等待后直接命中缓存
+        return self._upload_locks[hash((server_address, content_key)) % len(self._upload_locks)]
+
+    def get(self, server_address, content_key):
+        key = (server_address, content_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            self._entries.move_to_end(key)
+            return dict(entry)
+
+    def put(self, server_address, content_key, remote_name):
+        key = (server_address, content_key)
+        with self._lock:
+            # 远程同名文件已被新内容覆盖，旧记录不再有效
+            stale = [
+                other for other, entry in self._entries.items()
+                if other[0] == server_address and other != key and entry["remote_name"] == remote_name
+            ]
+            for other in stale:
+                del self._entries[other]
+            
+            self._entries[key] = {"remote_name": remote_name, "verified": time.time()}
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                (evicted_server, _), entry = self._entries.popitem(last=False)
+                evicted.append((evicted_server, entry["remote_name"]))
+        
+        if self.on_evict is not None:
+            for evicted_server, evicted_name in evicted:
+                try:
+                    self.on_evict(evicted_server, evicted_name)
+                except Exception as e:
+                    logger.debug("upload cleanup failed for %s: %s", evicted_name, e)
+
+    def mark_verified(self, server_address, content_key):
+        with self._lock:
+            entry = self._entries.get((server_address, content_key))
+            if entry is not None:
+                entry["verified"] = time.time()
+
+    def invalidate(self, server_address, content_key):
+        with self._lock:
+            self._entries.pop((server_address, content_key), None)
+
+    def clear(self, server_address=None):
+        with self._lock:
+            if server_address is None:
+                self._entries.clear()
+            else:
+                for key in [key for key in self._entries if key[0] == server_address]:
+                    del self._entries[key]
+
+
+upload_cache = UploadCache()
+
+UPLOAD_SUBFOLDER = os.environ.get("POND_REMOTE_UPLOAD_SUBFOLDER", "pond_remote").strip("/")
+
+
+def content_filename(content_key, ext):
+    return f"pond_{content_key[:32]}{ext}"
+
+
+def set_upload_cleanup_handler(handler):
+    # ComfyUI 本身没有删除输入文件的接口；需要清理时由调用方提供 handler(server_address, remote_name)，
+    # 在上传缓存淘汰条目时调用
+    upload_cache.on_evict = handler
+
+
+RESULT_CACHE_MAX_BYTES = _env_int("POND_REMOTE_RESULT_CACHE_MB", 2048) << 20
+# 只影响上传编码方式（均为无损）的选项不参与缓存键
+RESULT_CACHE_IGNORED_OPTIONS = ("use_result_cache", "image_format", "image_compress_level")
+
+
+def default_result_cache_dir():
+    path = os.environ.get("POND_REMOTE_RESULT_CACHE_DIR")
+    if path:
+        return path
+    try:
+        base = folder_paths.get_user_directory()
+    except Exception:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pond_remote_results")
+
+
+def plan_input_hashes(plan):
+    hashes = []
+    for item in plan:
+        value = item["value"]
+        if isinstance(value, torch.Tensor):
+            hashes.append(tensor_content_hash(value))
+        elif isinstance(value, dict) and isinstance(value.get("waveform"), torch.Tensor):
+            hashes.append(tensor_content_hash(value["waveform"], value.get("sample_rate")))
+        else:
+            hashes.append(hashlib.sha256(str(value).encode()).hexdigest())
+    return hashes
+
+
+def result_cache_key(workflow, plan, options=None, input_hashes=None):
+    # 相当于对“输入替换为内容哈希后的工作流”取哈希，不需要先上传就能算出
+    digest = hashlib.sha256()
+    digest.update(json.dumps(workflow, sort_keys=True, ensure_ascii=False).encode())
+    
+    if input_hashes is None:
+        input_hashes = plan_input_hashes(plan)
+    for item, value_hash in zip(plan, input_hashes):
+        digest.update(json.dumps(
+            [item["node_id"], item["input_type"], item["input_key"], item["all_frames"], value_hash]
+        ).encode())
+    
+    options = {key: value for key, value in (options or {}).items() if key not in RESULT_CACHE_IGNORED_OPTIONS}
+    digest.update(json.dumps(options, sort_keys=True).encode())
+    return digest.hexdigest()
+
+
+class ResultCache:
+
+    def __init__(self, directory=None, max_bytes=None):
+        self.directory = directory or default_result_cache_dir()
+        self.max_bytes = max_bytes if max_bytes is not None else RESULT_CACHE_MAX_BYTES
+        self._lock = threading.Lock()
+        self._index = None
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _load_index(self):
+        # 以 meta.json 的修改时间作为最近使用时间，重启后按它恢复 LRU 顺序
+        if self._index is not None:
+            return
+        entries = []
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                path = self._entry_path(name)
+                if name.startswith(".tmp-"):
+                    shutil.rmtree(path, ignore_errors=True)
+                    continue
+                meta_path = os.path.join(path, "meta.json")
+                if not os.path.isfile(meta_path):
+                    continue
+                size = sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+                entries.append((os.path.getmtime(meta_path), name, size))
+        entries.sort()
+        self._index = OrderedDict((name, size) for _, name, size in entries)
+
+    def get(self, key):
+        with self._lock:
+            self._load_index()
+            if key not in self._index:
+                return None
+            self._index.move_to_end(key)
+        
+        path = self._entry_path(key)
+        try:
+            outputs = self._read(path)
+            os.utime(os.path.join(path, "meta.json"))
+            return outputs
+        except Exception as e:
+            logger.warning("结果缓存 %s 读取失败，已删除: %s", key[:12], e)
+            self.invalidate(key)
+            return None
+
+    def put(self, key, outputs):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = self._entry_path(f".tmp-{uuid.uuid4().hex}")
+        os.makedirs(tmp_path)
+        try:
+            size = self._write(tmp_path, outputs)
+            with self._lock:
+                self._load_index()
+                if key in self._index:
+                    self._index.move_to_end(key)
+                    shutil.rmtree(tmp_path, ignore_errors=True)
+                    return
+                # 先写临时目录再整体改名，中途失败或并发写入不会留下不完整的条目
+                os.replace(tmp_path, self._entry_path(key))
+                self._index[key] = size
+                self._evict_locked()
+        except Exception:
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            raise
+
+    def invalidate(self, key):
+        with self._lock:
+            if self._index is not None:
+                self._index.pop(key, None)
+        shutil.rmtree(self._entry_path(key), ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            self._index = OrderedDict()
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def _evict_locked(self):
+        total = sum(self._index.values())
+        while total > self.max_bytes and len(self._index) > 1:
+            key, size = self._index.popitem(last=False)
+            shutil.rmtree(self._entry_path(key), ignore_errors=True)
+            total -= size
+
+    def _write(self, path, outputs):
+        image, text, audio, video = outputs
+        # 图像和视频帧都来自 8 位文件，按 uint8 保存体积只有 float32 的四分之一
+        np.save(os.path.join(path, "image.npy"), image_to_uint8(image))
+        np.save(os.path.join(path, "video.npy"), image_to_uint8(video))
+        np.save(os.path.join(path, "audio.npy"), audio["waveform"].detach().cpu().float().numpy())
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump({"text": text, "sample_rate": audio["sample_rate"], "created": time.time()}, f, ensure_ascii=False)
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+    def _read(self, path):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        image = torch.from_numpy(np.load(os.path.join(path, "image.npy"))).to(torch.float32).div_(255.0)
+        video = torch.from_numpy(np.load(os.path.join(path, "video.npy"))).to(torch.float32).div_(255.0)
+        audio = {
+            "waveform": torch.from_numpy(np.load(os.path.join(path, "audio.npy"))),
+            "sample_rate": meta["sample_rate"],
+        }
+        return (image, meta["text"], audio, video)
+
+
+result_cache = ResultCache()
+
+JOB_STORE_RETENTION = _env_float("POND_REMOTE_JOB_STORE_HOURS", 24.0) * 3600
+# 记录中的任务还可能在远程排队、执行，或已完成但结果没有取回，重新执行同一任务时接回它
+JOB_STORE_RESUMABLE = ("submitted", "finished")
+
+
+def default_job_store_path():
+    # 设为空字符串关闭任务记录
+    path = os.environ.get("POND_REMOTE_JOB_STORE")
+    if path is not None:
+        return path
+    try:
+        base = folder_paths.get_user_directory()
+    except Exception:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pond_remote_jobs.sqlite3")
+
+
+class JobStore:
+    
+    # 持久化的提交记录（SQLite）：服务器、prompt_id、输入哈希和状态，ComfyUI 重启后据此接回远程任务
+    def __init__(self, path=None, retention=None):
+        self.path = default_job_store_path() if path is None else path
+        self.retention = retention if retention is not None else JOB_STORE_RETENTION
+        self._lock = threading.Lock()
+        self._conn = None
+        self._broken = False
+    
+    @property
+    def enabled(self):
+        return bool(self.path) and not self._broken
+    
+    def _connect(self):
+        # 首次使用时才打开；打开失败后不再重试，任务照常执行，只是重启后无法接回
+        if self._conn is None and self.enabled:
+            try:
+                import sqlite3
+                directory = os.path.dirname(os.path.abspath(self.path))
+                os.makedirs(directory, exist_ok=True)
+                conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None, check_same_thread=False)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute(
+                    "CREATE TABLE IF NOT EXISTS jobs ("
+                    "prompt_id TEXT PRIMARY KEY, job_key TEXT NOT NULL, server TEXT NOT NULL, "
+                    "input_hashes TEXT NOT NULL, status TEXT NOT NULL, created REAL NOT NULL, updated REAL NOT NULL)"
+                )
+                conn.execute("CREATE INDEX IF NOT EXISTS jobs_by_key ON jobs (job_key, status)")
+                conn.execute("DELETE FROM jobs WHERE updated < ?", (time.time() - self.retention,))
+                self._conn = conn
+            except Exception as e:
+                self._broken = True
+                logger.warning("任务记录 %s 打开失败，重启后将无法接回远程任务: %s", self.path, e)
+        return self._conn
+    
+    def _execute(self, sql, params=()):
+        with self._lock:
+            conn = self._connect()
+            if conn is None:
+                return []
+            try:
+                return conn.execute(sql, params).fetchall()
+            except Exception as e:
+                logger.warning("任务记录读写失败: %s", e)
+                return []
+    
+    def record(self, job_key, server_address, prompt_id, input_hashes=()):
+        now = time.time()
+        self._execute(
+            "INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, 'submitted', ?, ?)",
+            (prompt_id, job_key, server_address, json.dumps(list(input_hashes)), now, now),
+        )
+    
+    def update(self, prompt_id, status):
+        self._execute("UPDATE jobs SET status = ?, updated = ? WHERE prompt_id = ?", (status, time.time(), prompt_id))
+    
+    def find(self, job_key, servers):
+        # 返回 (server, prompt_id)，最新的在前；只考虑本次可用的服务器
+        placeholders = ", ".join("?" for _ in JOB_STORE_RESUMABLE)
+        rows = self._execute(
+            f"SELECT server, prompt_id FROM jobs WHERE job_key = ? AND status IN ({placeholders}) "
+            "AND updated >= ? ORDER BY created DESC",
+            (job_key, *JOB_STORE_RESUMABLE, time.time() - self.retention),
+        )
+        return [(server, prompt_id) for server, prompt_id in rows if server in servers]
+    
+    def pending(self):
+        placeholders = ", ".join("?" for _ in JOB_STORE_RESUMABLE)
+        rows = self._execute(
+            "SELECT prompt_id, job_key, server, input_hashes, status, created, updated FROM jobs "
+            f"WHERE status IN ({placeholders}) ORDER BY created",
+            JOB_STORE_RESUMABLE,
+        )
+        columns = ("prompt_id", "job_key", "server", "input_hashes", "status", "created", "updated")
+        return [dict(zip(columns, row), input_hashes=json.loads(row[3])) for row in rows]
+    
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+job_store = JobStore()
+
+EVENT_HUB_HISTORY_POLL = _env_float("POND_REMOTE_HISTORY_POLL", 5.0)
+EVENT_HUB_RECONNECT_DELAY = _env_float("POND_REMOTE_WS_RECONNECT", 2.0)
+EVENT_HUB_IDLE = _env_float("POND_REMOTE_WS_IDLE", 600.0)
+
+
+class PromptWatch:
+
+    PROGRESS_EVENTS = ("execution_start", "executing", "progress", "execution_cached")
+
+    def __init__(self, prompt_id):
+        self.prompt_id = prompt_id
+        self.status = None
+        self.outputs = {}
+        self.cached_nodes = []
+        # watch 之前暂存的事件超出上限被丢弃过，完成后需要从 /history 补全输出
+        self.events_dropped = False
+        # 按事件到达时间统计远程每个节点的耗时
+        self.started_at = None
+        self.finished_at = None
+        self.cancelled = False
+        self.current_node = None
+        self.node_timings = OrderedDict()
+        self._node_started = None
+        self._cond = threading.Condition()
+        self._callbacks = []
+        self._listeners = []
+
+    @property
+    def done(self):
+        return self.status is not None
+
+    def add_progress_listener(self, listener):
+        # listener(watch, msg_type, data)，在事件线程中调用
+        self._listeners.append(listener)
+
+    def _close_node(self, now):
+        if self.current_node is not None:
+            timing = self.node_timings.setdefault(self.current_node, {"seconds": 0.0, "cached": False})
+            timing["seconds"] += now - self._node_started
+        self.current_node = None
+        self._node_started = None
+
+    def handle_event(self, msg_type, data, received_at=None):
+        now = received_at if received_at is not None else time.time()
+        with self._cond:
+            if self.status is not None:
+                return
+            
+            if msg_type == "execution_start":
+                self.started_at = self.started_at or now
+            
+            elif msg_type == "executing":
+                self._close_node(now)
+                node_id = data.get("node")
+                if node_id is None:
+                    self.status = {"status_str": "success"}
+                else:
+                    self.started_at = self.started_at or now
+                    self.current_node = node_id
+                    self._node_started = now
+            
+            elif msg_type == "execution_success":
+                self.status = {"status_str": "success"}
+            
+            elif msg_type == "executed":
+                node_id = data.get("node")
+                if node_id is not None:
+                    self.outputs[node_id] = data.get("output", {})
+            
+            elif msg_type == "execution_cached":
+                nodes = data.get("nodes", [])
+                self.cached_nodes.extend(nodes)
+                for node_id in nodes:
+                    self.node_timings.setdefault(node_id, {"seconds": 0.0, "cached": True})
+            
+            elif msg_type == "execution_error":
+                self.status = {"status_str": "error", "error": data}
+            
+            elif msg_type == "execution_interrupted":
+                self.status = {"status_str": "error", "error": data, "interrupted": True}
+            
+            finished = self.status is not None
+            if finished:
+                self._close_node(now)
+                self.finished_at = now
+                self._cond.notify_all()
+            listeners = list(self._listeners) if msg_type in self.PROGRESS_EVENTS else []
+        
+        for listener in listeners:
+            try:
+                listener(self, msg_type, data)
+            except Exception as e:
+                logger.debug("progress listener failed: %s", e)
+        
+        if finished:
+            self._run_callbacks()
+
+    def finish_from_history(self, history_entry):
+        status = history_entry.get("status", {}) or {}
+        status_str = status.get("status_str")
+        if not status.get("completed") and status_str not in ("success", "error"):
+            return False
+        
+        with self._cond:
+            if self.status is None:
+                self.status = {"status_str": status_str or "success"}
+            for node_id, output in (history_entry.get("outputs") or {}).items():
+                self.outputs.setdefault(node_id, output)
+            self._cond.notify_all()
+        
+        self._run_callbacks()
+        return True
+
+    def add_done_callback(self, callback):
+        with self._cond:
+            if self.status is None:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def _run_callbacks(self):
+        with self._cond:
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logger.debug("prompt watch callback failed: %s", e)
+
+    def wait(self, timeout):
+        with self._cond:
+            return self._cond.wait_for(lambda: self.status is not None, timeout)
+
+
+class RemoteEventHub:
+
+    MAX_EARLY_PROMPTS = 256
+    MAX_EARLY_EVENTS = 512
+
+    def __init__(self, server_address):
+        import uuid
+        self.server_address = server_address
+        self.client_id = uuid.uuid4().hex
+        self._watches = {}
+        self._early_events = OrderedDict()
+        self._lock = threading.Lock()
+        self._connected = threading.Event()
+        self._thread = None
+        self._ws = None
+        self._stop_event = threading.Event()
+        self._last_used = time.time()
+
+    def start(self):
+        # 每次 get_event_hub 都会调用，同时记录最近使用时间
+        with self._lock:
+            self._last_used = time.time()
+            if self._thread is not None and self._thread.is_alive() and not self._stop_event.is_set():
+                return
+            # 每个连接线程有自己的停止标记，空闲退出中的旧线程不会被重新启动的新线程复活
+            self._stop_event = threading.Event()
+            self._thread = threading.Thread(target=self._run, args=(self._stop_event,), name="pond_remote_ws", daemon=True)
+            self._thread.start()
+            self._schedule_idle_check(self._stop_event)
+
+    def stop(self):
+        self._stop_event.set()
+        ws = self._ws
+        if ws is not None:
+            try:
+                ws.close()
+            except:
+                pass
+
+    def _schedule_idle_check(self, stop_event):
+        timer = threading.Timer(min(60.0, EVENT_HUB_IDLE), self._check_idle, args=(stop_event,))
+        timer.daemon = True
+        timer.start()
+
+    def _check_idle(self, stop_event):
+        # 没有等待中的任务且长时间未使用时断开连接、停止重连（服务器不可达或已从列表中移除时也不会一直重连）
+        with self._lock:
+            if stop_event.is_set():
+                return
+            idle = not self._watches and time.time() - self._last_used > EVENT_HUB_IDLE
+            if idle:
+                # 在锁内置位，之后的 start() 一定会启动新线程；同时取出的 ws 也一定属于本线程
+                stop_event.set()
+                ws = self._ws
+        if not idle:
+            self._schedule_idle_check(stop_event)
+            return
+        logger.debug("closing idle websocket to %s", self.server_address)
+        if ws is not None:
+            try:
+                ws.close()
+            except Exception:
+                pass
+
+    def ensure_connected(self, timeout):
+        self.start()
+        return self._connected.wait(timeout)
+
+    def _run(self, stop_event):
+        import websocket
+        
+        ws_url = f"ws://{self.server_address}/ws?clientId={self.client_id}"
+        
+        def on_open(ws):
+            self._connected.set()
+            # 断线期间可能漏掉完成事件，重连后立即用 /history 核对所有等待中的任务
+            with self._lock:
+                watches = list(self._watches.values())
+            for watch in watches:
+                self.refresh_from_history(watch.prompt_id)
+        
+        def on_message(ws, message):
+            self._dispatch(message)
+        
+        def on_error(ws, error):
+            logger.debug("websocket error from %s: %s", self.server_address, error)
+        
+        def on_close(ws, close_status_code, close_msg):
+            self._connected.clear()
+        
+        while not stop_event.is_set():
+            ws = websocket.WebSocketApp(
+                ws_url,
+                on_message=on_message,
+                on_error=on_error,
+                on_close=on_close,
+                on_open=on_open
+            )
+            self._ws = ws
+            try:
+                ws.run_forever(ping_interval=30, ping_timeout=10)
+            except Exception as e:
+                logger.debug("websocket loop for %s stopped: %s", self.server_address, e)
+            self._connected.clear()
+            if stop_event.wait(EVENT_HUB_RECONNECT_DELAY):
+                break
+
+    def _dispatch(self, message):
+        if isinstance(message, bytes):
+            return
+        try:
+            data = json.loads(message)
+        except Exception:
+            return
+        
+        msg_type = data.get("type")
+        msg_data = data.get("data") or {}
+        prompt_id = msg_data.get("prompt_id")
+        if prompt_id is None:
+            return
+        
+        with self._lock:
+            watch = self._watches.get(prompt_id)
+            if watch is None:
+                # /prompt 返回之前事件就可能到达，先暂存，watch() 时回放
+                self._buffer_early_event(prompt_id, msg_type, msg_data)
+                return
+        
+        watch.handle_event(msg_type, msg_data)
+
+    def _buffer_early_event(self, prompt_id, msg_type, msg_data):
+        # 调用方持有锁。提交后很久才 watch（Submit → Fetch），或者是共用 client_id 的其他客户端的任务时，
+        # 事件可能一直没人认领：每个任务的事件数和暂存时间都有上限
+        now = time.time()
+        events = self._early_events.pop(prompt_id, None)
+        if events is None:
+            events = deque(maxlen=self.MAX_EARLY_EVENTS)
+        if msg_type == "progress" and events and events[-1][0] == "progress":
+            # 连续的进度事件只需保留最新一条
+            events.pop()
+        events.append((msg_type, msg_data, now))
+        # 重新插入到末尾，按最近收到事件的顺序淘汰
+        self._early_events[prompt_id] = events
+        while self._early_events:
+            oldest = next(iter(self._early_events.values()))
+            if len(self._early_events) <= self.MAX_EARLY_PROMPTS and now - oldest[-1][2] <= EVENT_HUB_IDLE:
+                break
+            self._early_events.popitem(last=False)
+
+    def watch(self, prompt_id, progress_listener=None):
+        with self._lock:
+            watch = self._watches.get(prompt_id)
+            if watch is None:
+                watch = PromptWatch(prompt_id)
+                self._watches[prompt_id] = watch
+            if progress_listener is not None:
+                watch.add_progress_listener(progress_listener)
+            # 在锁内回放：_dispatch 要拿到锁之后才能看到这个 watch，实时事件不会插到暂存事件之前
+            # （否则先到的完成事件会让暂存的 executed 输出被丢弃）
+            early_events = self._early_events.pop(prompt_id, None) or ()
+            if len(early_events) == self.MAX_EARLY_EVENTS:
+                watch.events_dropped = True
+            for msg_type, msg_data, received_at in early_events:
+                watch.handle_event(msg_type, msg_data, received_at)
+        return watch
+
+    def unwatch(self, prompt_id):
+        with self._lock:
+            self._watches.pop(prompt_id, None)
+
+    def fetch_history_entry(self, prompt_id):
+        try:
+            url = f"http://{self.server_address}/history/{prompt_id}"
+            response = connection_manager.session(self.server_address).get(url, timeout=connection_manager.timeout("probe"))
+            if response.status_code != 200:
+                return None
+            return response.json().get(prompt_id)
+        except Exception as e:
+            logger.debug("history fetch for %s failed: %s", prompt_id, e)
+            return None
+
+    def refresh_from_history(self, prompt_id):
+        with self._lock:
+            watch = self._watches.get(prompt_id)
+        if watch is None or watch.done:
+            return False
+        
+        entry = self.fetch_history_entry(prompt_id)
+        if not entry:
+            return False
+        return watch.finish_from_history(entry)
+
+    def merge_history_outputs(self, watch):
+        entry = self.fetch_history_entry(watch.prompt_id)
+        if entry:
+            for node_id, output in (entry.get("outputs") or {}).items():
+                watch.outputs.setdefault(node_id, output)
+
+
+_event_hubs = {}
+_event_hubs_lock = threading.Lock()
+
+
+def get_event_hub(server_address):
+    with _event_hubs_lock:
+        hub = _event_hubs.get(server_address)
+        if hub is None:
+            hub = RemoteEventHub(server_address)
+            _event_hubs[server_address] = hub
+    hub.start()
+    return hub
+
+
+DOWNLOAD_MAX_WORKERS = _env_int("POND_REMOTE_DOWNLOAD_WORKERS", 4)
+UPLOAD_MAX_WORKERS = _env_int("POND_REMOTE_UPLOAD_WORKERS", 4)
+DOWNLOAD_CHUNK_SIZE = 1 << 18
+DOWNLOAD_SPOOL_MAX = _env_int("POND_REMOTE_SPOOL_MAX_MB", 64) << 20
+DOWNLOAD_RESUME_ATTEMPTS = _env_int("POND_REMOTE_RESUME_ATTEMPTS", 5)
+
+
+class TransferStats:
+
+    def __init__(self, smoothing=0.3, min_sample_bytes=256 << 10):
+        self.smoothing = smoothing
+        self.min_sample_bytes = min_sample_bytes
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, server_address, direction, nbytes, seconds, resumes=0):
+        rate = nbytes / seconds if seconds > 0 else 0.0
+        with self._lock:
+            stats = self._stats.setdefault((server_address, direction), {
+                "bytes": 0, "seconds": 0.0, "transfers": 0, "resumes": 0,
+                "last_rate": 0.0, "avg_rate": 0.0,
+            })
+            stats["bytes"] += nbytes
+            stats["seconds"] += seconds
+            stats["transfers"] += 1
+            stats["resumes"] += resumes
+            # 小文件的耗时主要是请求延迟，不计入速率；其余用指数平均平滑
+            if nbytes < self.min_sample_bytes:
+                return rate
+            stats["last_rate"] = rate
+            if stats["avg_rate"]:
+                stats["avg_rate"] += self.smoothing * (rate - stats["avg_rate"])
+            else:
+                stats["avg_rate"] = rate
+        return rate
+
+    def rate(self, server_address, direction):
+        with self._lock:
+            stats = self._stats.get((server_address, direction))
+            return stats["avg_rate"] if stats else None
+
+    def snapshot(self, server_address=None):
+        with self._lock:
+            return {
+                f"{server} {direction}": dict(stats)
+                for (server, direction), stats in self._stats.items()
+                if server_address is None or server == server_address
+            }
+
+
+transfer_stats = TransferStats()
+
+
+def open_spool():
+    # 小文件留在内存里，超过阈值自动转存到磁盘
+    import tempfile
+    return tempfile.SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_MAX)
+
+
+def stream_view(server_address, params, sink, chunk_size=DOWNLOAD_CHUNK_SIZE):
+    session = connection_manager.session(server_address)
+    url = f"http://{server_address}/view"
+    received = 0
+    total = None
+    resumes = 0
+    started = time.perf_counter()
+    
+    while True:
+        headers = {"Range": f"bytes={received}-"} if received else None
+        try:
+            with session.get(url, params=params, headers=headers, stream=True,
+                             timeout=connection_manager.timeout("download")) as response:
+                if received and response.status_code == 200:
+                    # 服务器忽略了 Range，只能从头重新下载
+                    sink.seek(0)
+                    sink.truncate()
+                    received = 0
+                elif response.status_code not in (200, 206):
+                    raise RemoteExecutionError(f"下载失败: HTTP {response.status_code}", "http", response.status_code)
+                
+                if total is None:
+                    content_range = response.headers.get("Content-Range", "")
+                    if "/" in content_range and not content_range.endswith("/*"):
+                        total = int(content_range.rsplit("/", 1)[1])
+                    elif response.status_code == 200 and response.headers.get("Content-Length"):
+                        total = int(response.headers["Content-Length"])
+                
+                for chunk in response.iter_content(chunk_size=chunk_size):
+                    sink.write(chunk)
+                    received += len(chunk)
+            
+            if total is None or received >= total:
+                break
+            raise requests.exceptions.ChunkedEncodingError(f"连接中断: {received}/{total}")
+        except (requests.exceptions.ConnectionError,
+                requests.exceptions.ChunkedEncodingError,
+                requests.exceptions.Timeout) as e:
+            resumes += 1
+            if resumes > DOWNLOAD_RESUME_ATTEMPTS:
+                raise
+            logger.warning("下载 %s 中断（已接收 %d 字节），第 %d 次续传: %s",
+                           params.get("filename"), received, resumes, e)
+            time.sleep(min(connection_manager.retry_backoff * resumes, 5.0))
+    
+    seconds = time.perf_counter() - started
+    _run_context.download_seconds = getattr(_run_context, "download_seconds", 0.0) + seconds
+    note_io("download_bytes", received)
+    note_io("download_seconds", seconds)
+    rate = transfer_stats.record(server_address, "download", received, seconds, resumes)
+    logger.debug("下载 %s: %d 字节, %.2f 秒, %.1f KB/s", params.get("filename"), received, seconds, rate / 1024)
+    sink.flush()
+    sink.seek(0)
+    return received
+
+
+def run_in_pool(fn, items, max_workers):
+    # 供已在 I/O 线程中运行的代码使用的同步并行版本，结果顺序与输入一致
+    items = list(items)
+    workers = max(1, min(max_workers, len(items)))
+    if workers == 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pond_remote_pool") as pool:
+        return list(pool.map(fn, items))
+
+
+class RemoteAsyncEngine:
+
+    def __init__(self, io_workers=None):
+        self.io_workers = io_workers if io_workers is not None else _env_int("POND_REMOTE_IO_WORKERS", 16)
+        self._loop = None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+                
+                def run_loop():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+                
+                thread = threading.Thread(target=run_loop, name="pond_remote_engine", daemon=True)
+                thread.start()
+                ready.wait()
+                self._executor = ThreadPoolExecutor(max_workers=self.io_workers, thread_name_prefix="pond_remote_io")
+                self._loop = loop
+            return self._loop
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro):
+        # 供 ComfyUI 执行线程调用；不能在引擎自身的事件循环里调用
+        return self.submit(coro).result()
+
+    async def call(self, fn, *args, **kwargs):
+        # 阻塞的网络请求和编解码放到共享 I/O 线程池，事件循环只负责编排
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(fn, *args, **kwargs))
+
+    async def map(self, fn, items, limit):
+        semaphore = asyncio.Semaphore(max(1, limit))
+        
+        async def run_item(item):
+            async with semaphore:
+                return await self.call(fn, item)
+        
+        return list(await asyncio.gather(*(run_item(item) for item in items)))
+
+    async def wait_prompt(self, hub, prompt_id, timeout, progress_listener=None, cancel_check=None, refresh_first=False):
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+        
+        def on_done(watch):
+            loop.call_soon_threadsafe(lambda: finished.done() or finished.set_result(True))
+        
+        watch = hub.watch(prompt_id, progress_listener)
+        watch.add_done_callback(on_done)
+        deadline = loop.time() + timeout
+        next_refresh = loop.time() + EVENT_HUB_HISTORY_POLL
+        # 需要检查本地取消时缩短等待间隔，/history 兜底仍按原间隔
+        interval = min(INTERRUPT_POLL, EVENT_HUB_HISTORY_POLL) if cancel_check else EVENT_HUB_HISTORY_POLL
+        try:
+            # 接回的任务可能早已完成，也收不到其事件（事件只推送给提交时的 client_id），先查一次 /history
+            if refresh_first:
+                await self.call(hub.refresh_from_history, prompt_id)
+            while not watch.done:
+                if cancel_check is not None and cancel_check():
+                    watch.cancelled = True
+                    break
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(asyncio.shield(finished), min(remaining, interval))
+                except asyncio.TimeoutError:
+                    if loop.time() >= next_refresh:
+                        next_refresh = loop.time() + EVENT_HUB_HISTORY_POLL
+                        await self.call(hub.refresh_from_history, prompt_id)
+            
+            # 被缓存的节点不会发送 executed 事件，暂存时被丢弃的事件也可能含有输出，都从 /history 补全
+            if watch.done and (watch.cached_nodes or watch.events_dropped) and watch.status.get("status_str") == "success":
+                await self.call(hub.merge_history_outputs, watch)
+        finally:
+            hub.unwatch(prompt_id)
+        return watch
+
+
+remote_engine = RemoteAsyncEngine()
+
+
+INTERRUPT_POLL = _env_float("POND_REMOTE_INTERRUPT_POLL", 0.25)
+
+
+def local_interrupt_requested():
+    try:
+        import comfy.model_management
+        return comfy.model_management.processing_interrupted()
+    except Exception:
+        return False
+
+
+def interrupt_exception_class():
+    try:
+        import comfy.model_management
+        return comfy.model_management.InterruptProcessingException
+    except Exception:
+        return None
+
+
+def raise_interrupted():
+    # 不重置中断标志：批量模式下其他子任务也要看到它，ComfyUI 在下一次执行开始时会自行清除
+    exception_class = interrupt_exception_class()
+    if exception_class is not None:
+        raise exception_class()
+    raise RemoteExecutionError("已取消", "cancelled")
+
+
+class RemoteProgressForwarder:
+    
+    # 把远程事件转成本地节点的进度条：采样等带 progress 事件的节点显示步数，其余时候显示已完成节点数
+    def __init__(self, node_id, total_nodes):
+        self.node_id = node_id
+        self.total_nodes = max(1, total_nodes)
+        self.bar = None
+        try:
+            import comfy.utils
+            try:
+                self.bar = comfy.utils.ProgressBar(self.total_nodes, node_id=node_id)
+            except TypeError:
+                self.bar = comfy.utils.ProgressBar(self.total_nodes)
+        except Exception:
+            self.bar = None
+    
+    def update(self, value, total):
+        if self.bar is not None:
+            self.bar.update_absolute(value, total)
+    
+    def __call__(self, watch, msg_type, data):
+        if msg_type == "progress":
+            self.update(data.get("value", 0), data.get("max", 1) or 1)
+        elif msg_type in ("executing", "execution_cached"):
+            self.update(min(len(watch.node_timings), self.total_nodes), self.total_nodes)
+
+
+# 当前线程正在为哪个任务工作；底层的上传/下载函数通过它记录字节数、耗时和被吞掉的异常
+_run_context = threading.local()
+
+
+def active_report():
+    return getattr(_run_context, "report", None)
+
+
+@contextlib.contextmanager
+def reporting(report):
+    previous = getattr(_run_context, "report", None)
+    _run_context.report = report
+    try:
+        yield report
+    finally:
+        _run_context.report = previous
+
+
+def note_io(field, amount):
+    report = active_report()
+    if report is not None:
+        report.add_io(field, amount)
+
+
+def note_error(phase, error, **detail):
+    logger.debug("%s failed: %s", phase, error)
+    report = active_report()
+    if report is not None:
+        report.add_error(phase, error, **detail)
+
+
+def classify_error(error):
+    if isinstance(error, RemoteExecutionError):
+        return error.kind
+    interrupt_class = interrupt_exception_class()
+    if interrupt_class is not None and isinstance(error, interrupt_class):
+        return "cancelled"
+    if isinstance(error, requests.exceptions.Timeout):
+        return "timeout"
+    if isinstance(error, requests.exceptions.ConnectionError):
+        return "connection"
+    if isinstance(error, requests.exceptions.RequestException):
+        return "http"
+    if isinstance(error, (OSError, subprocess.SubprocessError)):
+        return "io"
+    return "internal"
+
+
+def is_server_fault(error_entry):
+    # 连接失败、超时和 5xx 才算服务器的问题：换服务器可能成功，也应让该服务器进入冷却；
+    # 输入无效、本地编码失败、4xx（如工作流校验失败）换服务器也一样失败
+    kind = error_entry["kind"]
+    if kind in ("connection", "timeout"):
+        return True
+    return kind == "http" and (error_entry.get("status") or 500) >= 500
+
+
+class RunReport:
+    
+    IO_FIELDS = ("encode_seconds", "upload_bytes", "upload_seconds", "download_bytes", "download_seconds", "decode_seconds")
+    
+    def __init__(self, label=""):
+        self.label = label
+        self.server = None
+        self.prompt_id = None
+        self.cache_hit = False
+        self.reattached = False
+        self.phases = OrderedDict()
+        self.spans = []
+        self.io = dict.fromkeys(self.IO_FIELDS, 0)
+        self.uploads = []
+        self.nodes = []
+        self.downloads = []
+        self.children = []
+        self.error = None
+        self.errors = []
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+        self.total = None
+    
+    def add(self, phase, seconds, started_at=None):
+        with self._lock:
+            self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+            if started_at is not None:
+                self.spans.append((phase, started_at, started_at + seconds))
+    
+    def timer(self):
+        started = time.perf_counter()
+        started_at = time.time()
+        return lambda phase: self.add(phase, time.perf_counter() - started, started_at)
+    
+    def add_io(self, field, amount):
+        with self._lock:
+            self.io[field] += amount
+    
+    def add_error(self, phase, error, **detail):
+        # 不影响最终结果的错误（如切换服务器前的上传失败、单个输出下载失败）
+        entry = {"phase": phase, "kind": classify_error(error), "message": str(error)[:500]}
+        status = getattr(error, "status", None) or getattr(getattr(error, "response", None), "status_code", None)
+        if status is not None:
+            entry["status"] = status
+        entry.update(detail)
+        with self._lock:
+            self.errors.append(entry)
+    
+    def fail(self, error):
+        self.error = {"kind": classify_error(error), "message": str(error)[:500]}
+    
+    def add_watch(self, watch, workflow, submitted_at):
+        # 排队等待：提交到远程开始执行；执行：开始执行到收到完成事件
+        if watch.started_at is not None:
+            self.add("queue_wait", max(0.0, watch.started_at - submitted_at), submitted_at)
+            if watch.finished_at is not None:
+                self.add("execute", watch.finished_at - watch.started_at, watch.started_at)
+        elif watch.finished_at is not None:
+            self.add("queue_wait", max(0.0, watch.finished_at - submitted_at), submitted_at)
+        for node_id, timing in watch.node_timings.items():
+            self.nodes.append({
+                "node": node_id,
+                "class_type": workflow.get(node_id, {}).get("class_type", ""),
+                "seconds": round(timing["seconds"], 4),
+                "cached": timing["cached"],
+            })
+    
+    def finish(self):
+        self.total = time.perf_counter() - self._started
+        return self
+    
+    def elapsed(self):
+        return self.total if self.total is not None else time.perf_counter() - self._started
+    
+    def to_dict(self):
+        return {
+            "label": self.label,
+            "server": self.server,
+            "prompt_id": self.prompt_id,
+            "cache_hit": self.cache_hit,
+            "reattached": self.reattached,
+            "started_at": round(self.started_at, 3),
+            "total": round(self.elapsed(), 4),
+            "phases": {phase: round(seconds, 4) for phase, seconds in self.phases.items()},
+            "io": {field: round(value, 4) if isinstance(value, float) else value for field, value in self.io.items()},
+            "uploads": self.uploads,
+            "nodes": self.nodes,
+            "downloads": self.downloads,
+            "error": self.error,
+            "errors": self.errors,
+            "children": [child.to_dict() for child in self.children],
+        }
+    
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+    
+    def metrics(self):
+        # 供监控钩子使用的扁平指标；批量任务把子任务的数值累加进来
+        reports = [self] + self.children
+        phases = OrderedDict()
+        io_totals = dict.fromkeys(self.IO_FIELDS, 0)
+        errors = []
+        for report in reports:
+            for phase, seconds in report.phases.items():
+                phases[phase] = phases.get(phase, 0.0) + seconds
+            for field, value in report.io.items():
+                io_totals[field] += value
+            errors += report.errors
+        
+        if self.error is None:
+            status = "ok"
+        elif self.error["kind"] == "cancelled":
+            status = "cancelled"
+        else:
+            status = "error"
+        return {
+            "status": status,
+            "error_kind": self.error["kind"] if self.error else None,
+            "server": self.server,
+            "cache_hit": self.cache_hit,
+            "reattached": sum(int(report.reattached) for report in reports),
+            "jobs": max(1, len(self.children)),
+            "total_seconds": self.elapsed(),
+            "phases": phases,
+            "io": io_totals,
+            "errors": [{"phase": error["phase"], "kind": error["kind"]} for error in errors],
+        }
+    
+    def summary(self):
+        parts = [f"total={self.to_dict()['total']:.3f}s"]
+        parts += [f"{phase}={seconds:.3f}s" for phase, seconds in self.phases.items()]
+        if self.cache_hit:
+            parts.append("(结果缓存命中)")
+        if self.reattached:
+            parts.append("(接回已提交的任务)")
+        if self.error:
+            parts.append(f"[{self.error['kind']}] {self.error['message']}")
+        
+        slowest = sorted(self.nodes, key=lambda node: node["seconds"], reverse=True)[:3]
+        if slowest:
+            parts.append("| 最慢节点: " + ", ".join(
+                f"{node['class_type'] or node['node']}={node['seconds']:.3f}s" for node in slowest
+            ))
+        
+        if self.children:
+            # 子任务并行执行，各阶段按累计耗时汇总
+            totals = OrderedDict()
+            for child in self.children:
+                for phase, seconds in child.phases.items():
+                    totals[phase] = totals.get(phase, 0.0) + seconds
+            parts.append(f"| {len(self.children)} 个子任务累计:")
+            parts += [f"{phase}={seconds:.3f}s" for phase, seconds in totals.items()]
+        return " ".join(parts)
+
+
+_metrics_hooks = []
+
+
+def add_metrics_hook(hook):
+    # hook(report) 在每次执行结束后调用，report 为顶层 RunReport
+    _metrics_hooks.append(hook)
+    return hook
+
+
+def remove_metrics_hook(hook):
+    if hook in _metrics_hooks:
+        _metrics_hooks.remove(hook)
+
+
+def emit_run_report(report):
+    for hook in list(_metrics_hooks):
+        try:
+            hook(report)
+        except Exception as e:
+            logger.warning("指标钩子 %r 执行失败: %s", hook, e)
+
+
+class LoggingMetricsHook:
+    
+    def __init__(self, level=logging.INFO):
+        self.level = level
+    
+    def __call__(self, report):
+        logger.log(self.level, "pond_remote_run %s", json.dumps(report.metrics(), ensure_ascii=False))
+
+
+def _prometheus_labels(labels):
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n"))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}" if labels else ""
+
+
+class PrometheusTextfileHook:
+    
+    # 按 node_exporter textfile collector 的格式写出累计值，每次执行结束后原子替换文件
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._counters = OrderedDict()
+    
+    def _inc(self, name, labels, amount=1):
+        key = (name, tuple(labels))
+        self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def __call__(self, report):
+        metrics = report.metrics()
+        with self._lock:
+            self._inc("pond_remote_runs_total", [("status", metrics["status"]), ("error_kind", metrics["error_kind"] or "")])
+            self._inc("pond_remote_jobs_total", [], metrics["jobs"])
+            self._inc("pond_remote_cache_hits_total", [], int(metrics["cache_hit"]))
+            self._inc("pond_remote_reattached_total", [], metrics["reattached"])
+            self._inc("pond_remote_run_seconds_total", [], metrics["total_seconds"])
+            for phase, seconds in metrics["phases"].items():
+                self._inc("pond_remote_phase_seconds_total", [("phase", phase)], seconds)
+                self._inc("pond_remote_phase_count_total", [("phase", phase)])
+            for stage in ("encode", "upload", "download", "decode"):
+                self._inc("pond_remote_io_seconds_total", [("stage", stage)], metrics["io"][f"{stage}_seconds"])
+            for direction in ("upload", "download"):
+                self._inc("pond_remote_bytes_total", [("direction", direction)], metrics["io"][f"{direction}_bytes"])
+            for error in metrics["errors"]:
+                self._inc("pond_remote_errors_total", [("phase", error["phase"]), ("kind", error["kind"])])
+            text = self.render()
+        
+        directory = os.path.dirname(os.path.abspath(self.path))
+        os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+    
+    def render(self):
+        lines = []
+        declared = set()
+        for (name, labels), value in sorted(self._counters.items()):
+            if name not in declared:
+                declared.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_prometheus_labels(labels)} {round(value, 6) if isinstance(value, float) else value}")
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetryHook:
+    
+    # 每次执行一个 span，各阶段为子 span；默认使用 opentelemetry-api 的全局 tracer
+    def __init__(self, tracer=None):
+        from opentelemetry import trace
+        self._trace = trace
+        self.tracer = tracer or trace.get_tracer("pond_remote")
+    
+    def __call__(self, report):
+        metrics = report.metrics()
+        start_ns = int(report.started_at * 1e9)
+        attributes = {
+            "pond.server": report.server or "",
+            "pond.prompt_id": report.prompt_id or "",
+            "pond.cache_hit": report.cache_hit,
+            "pond.jobs": metrics["jobs"],
+            "pond.errors": len(metrics["errors"]),
+        }
+        for field, value in metrics["io"].items():
+            attributes[f"pond.{field}"] = value
+        
+        span = self.tracer.start_span("pond_remote.run", start_time=start_ns, attributes=attributes)
+        context = self._trace.set_span_in_context(span)
+        for child_report in [report] + report.children:
+            for phase, started_at, ended_at in child_report.spans:
+                child = self.tracer.start_span(
+                    f"pond_remote.{phase}", context=context, start_time=int(started_at * 1e9),
+                    attributes={"pond.label": child_report.label} if child_report.label else None
+                )
+                child.end(end_time=int(ended_at * 1e9))
+        
+        if report.error:
+            from opentelemetry.trace import Status, StatusCode
+            span.set_attribute("error.type", report.error["kind"])
+            span.set_status(Status(StatusCode.ERROR, report.error["message"]))
+        span.end(end_time=start_ns + int(report.elapsed() * 1e9))
+
+
+def default_metrics_file():
+    try:
+        base = folder_paths.get_user_directory()
+    except Exception:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    return os.path.join(base, "pond_remote_metrics.prom")
+
+
+def install_metrics_hooks_from_env():
+    # POND_REMOTE_METRICS 为逗号分隔的 log、prometheus、otel
+    for name in re.split(r"[,;\s]+", os.environ.get("POND_REMOTE_METRICS", "").strip().lower()):
+        if name == "log":
+            add_metrics_hook(LoggingMetricsHook())
+        elif name == "prometheus":
+            add_metrics_hook(PrometheusTextfileHook(os.environ.get("POND_REMOTE_METRICS_FILE") or default_metrics_file()))
+        elif name == "otel":
+            try:
+                add_metrics_hook(OpenTelemetryHook())
+            except ImportError:
+                logger.warning("未安装 opentelemetry-api，已忽略 otel 指标")
+        elif name:
+            logger.warning("未知的指标输出: %s", name)
+
+
+install_metrics_hooks_from_env()
+
+
+SERVER_POOL_POLICY = os.environ.get("POND_REMOTE_POOL_POLICY", "least_loaded")
+SERVER_POOL_PROBE_TTL = _env_float("POND_REMOTE_POOL_PROBE_TTL", 3.0)
+SERVER_POOL_FAILURE_COOLDOWN = _env_float("POND_REMOTE_POOL_COOLDOWN", 30.0)
+SERVER_POOL_OBJECT_INFO_TTL = _env_float("POND_REMOTE_OBJECT_INFO_TTL", 300.0)
+SERVER_POOL_MONITOR_IDLE = _env_float("POND_REMOTE_MONITOR_IDLE", 600.0)
+
+
+def parse_server_list(remote_ip, remote_port):
+    # 支持 "ip"、"ip:port"、"ip:port@权重"，多个服务器用逗号、分号或换行分隔
+    servers = []
+    seen = set()
+    for entry in re.split(r"[,;\s]+", str(remote_ip).strip()):
+        if not entry:
+            continue
+        
+        weight = 1
+        if "@" in entry:
+            entry, weight_str = entry.rsplit("@", 1)
+            try:
+                weight = max(1, int(weight_str))
+            except ValueError:
+                weight = 1
+        
+        entry = entry.split("://", 1)[-1].rstrip("/")
+        if not entry:
+            continue
+        if ":" not in entry:
+            entry = f"{entry}:{remote_port}"
+        
+        if entry not in seen:
+            seen.add(entry)
+            servers.append((entry, weight))
+    return servers
+
+
+class ServerPool:
+
+    POLICIES = ("least_loaded", "weighted_round_robin")
+
+    def __init__(self, policy=None, probe_ttl=None, failure_cooldown=None, object_info_ttl=None, monitor_idle=None):
+        self.policy = policy or SERVER_POOL_POLICY
+        self.probe_ttl = probe_ttl if probe_ttl is not None else SERVER_POOL_PROBE_TTL
+        self.failure_cooldown = failure_cooldown if failure_cooldown is not None else SERVER_POOL_FAILURE_COOLDOWN
+        self.object_info_ttl = object_info_ttl if object_info_ttl is not None else SERVER_POOL_OBJECT_INFO_TTL
+        self.monitor_idle = monitor_idle if monitor_idle is not None else SERVER_POOL_MONITOR_IDLE
+        self._states = {}
+        self._monitors = {}
+        self._lock = threading.Lock()
+
+    def _state(self, server_address):
+        state = self._states.get(server_address)
+        if state is None:
+            state = {
+                "healthy": None,
+                "checked": 0.0,
+                "latency": None,
+                "queue_depth": 0,
+                "in_flight": 0,
+                "failures": 0,
+                "cooldown_until": 0.0,
+                "wrr_current": 0,
+                "devices": [],
+                "node_classes": None,
+                "node_classes_checked": 0.0,
+                "last_used": 0.0,
+            }
+            self._states[server_address] = state
+        return state
+
+    def snapshot(self, server_address):
+        with self._lock:
+            return dict(self._state(server_address))
+
+    def needs_probe(self, server_address):
+        with self._lock:
+            state = self._state(server_address)
+            return state["healthy"] is None or time.time() - state["checked"] > self.probe_ttl
+
+    def is_reachable(self, server_address):
+        if self.needs_probe(server_address):
+            return self.probe(server_address)
+        with self._lock:
+            return bool(self._state(server_address)["healthy"])
+
+    def probe(self, server_address):
+        session = connection_manager.session(server_address)
+        start_time = time.perf_counter()
+        healthy = False
+        queue_depth = None
+        devices = None
+        try:
+            response = session.get(f"http://{server_address}/system_stats", timeout=connection_manager.timeout("probe"))
+            healthy = response.status_code == 200
+            if healthy:
+                devices = [
+                    {key: device.get(key) for key in ("name", "type", "vram_total", "vram_free")}
+                    for device in (response.json().get("devices") or [])
+                ]
+        except Exception as e:
+            logger.debug("probe of %s failed: %s", server_address, e)
+        latency = time.perf_counter() - start_time
+        
+        if healthy:
+            try:
+                response = session.get(f"http://{server_address}/queue", timeout=connection_manager.timeout("probe"))
+                if response.status_code == 200:
+                    queue = response.json()
+                    queue_depth = len(queue.get("queue_running", [])) + len(queue.get("queue_pending", []))
+            except Exception as e:
+                logger.debug("queue query on %s failed: %s", server_address, e)
+        
+        with self._lock:
+            state = self._state(server_address)
+            state["healthy"] = healthy
+            state["checked"] = time.time()
+            if healthy:
+                state["latency"] = latency if state["latency"] is None else 0.7 * state["latency"] + 0.3 * latency
+            if queue_depth is not None:
+                state["queue_depth"] = queue_depth
+            if devices is not None:
+                state["devices"] = devices
+        return healthy
+
+    def node_classes(self, server_address):
+        # 远程已安装的节点类型；/object_info 较大，按更长的 TTL 缓存，取不到时返回 None
+        with self._lock:
+            state = self._state(server_address)
+            if state["node_classes"] is not None and time.time() - state["node_classes_checked"] < self.object_info_ttl:
+                return state["node_classes"]
+            if state["healthy"] is False:
+                return state["node_classes"]
+        
+        try:
+            response = connection_manager.session(server_address).get(
+                f"http://{server_address}/object_info", timeout=connection_manager.timeout("download")
+            )
+            if response.status_code != 200:
+                return None
+            node_classes = frozenset(response.json())
+        except Exception as e:
+            logger.debug("object_info query on %s failed: %s", server_address, e)
+            return None
+        
+        with self._lock:
+            state = self._state(server_address)
+            state["node_classes"] = node_classes
+            state["node_classes_checked"] = time.time()
+        return node_classes
+
+    def missing_node_classes(self, server_address, class_types):
+        node_classes = self.node_classes(server_address)
+        if node_classes is None:
+            return []
+        return sorted(class_type for class_type in class_types if class_type not in node_classes)
+
+    def monitor(self, server_address):
+        # 后台定期刷新健康状态和队列长度，任务开始时不必再同步探测；长时间未使用时线程自动退出
+        with self._lock:
+            self._state(server_address)["last_used"] = time.time()
+            thread = self._monitors.get(server_address)
+            if thread is not None and thread.is_alive():
+                return
+            thread = threading.Thread(
+                target=self._monitor_loop, args=(server_address,), name=f"pond_remote_monitor_{server_address}", daemon=True
+            )
+            self._monitors[server_address] = thread
+        thread.start()
+
+    def _monitor_loop(self, server_address):
+        interval = max(0.5, self.probe_ttl * 0.8)
+        while True:
+            with self._lock:
+                if time.time() - self._state(server_address)["last_used"] > self.monitor_idle:
+                    if self._monitors.get(server_address) is threading.current_thread():
+                        del self._monitors[server_address]
+                    return
+            try:
+                if self.probe(server_address):
+                    self.node_classes(server_address)
+            except Exception as e:
+                logger.debug("monitor of %s failed: %s", server_address, e)
+            time.sleep(interval)
+
+    def mark_failure(self, server_address):
+        with self._lock:
+            state = self._state(server_address)
+            state["failures"] += 1
+            state["healthy"] = False
+            state["checked"] = time.time()
+            state["cooldown_until"] = time.time() + self.failure_cooldown * min(state["failures"], 4)
+
+    def mark_success(self, server_address):
+        with self._lock:
+            state = self._state(server_address)
+            state["failures"] = 0
+            state["cooldown_until"] = 0.0
+
+    def acquire(self, server_address):
+        with self._lock:
+            self._state(server_address)["in_flight"] += 1
+
+    def release(self, server_address):
+        with self._lock:
+            state = self._state(server_address)
+            state["in_flight"] = max(0, state["in_flight"] - 1)
+
+    def _load_key(self, server_address):
+        state = self._state(server_address)
+        latency = state["latency"] if state["latency"] is not None else float("inf")
+        return (state["queue_depth"] + state["in_flight"], latency)
+
+    def rank(self, servers, policy=None):
+        policy = policy or self.policy
+        now = time.time()
+        with self._lock:
+            available = []
+            unavailable = []
+            for server_address, weight in servers:
+                state = self._state(server_address)
+                if state["healthy"] is False or state["cooldown_until"] > now:
+                    unavailable.append(server_address)
+                else:
+                    available.append((server_address, weight))
+            
+            ordered = sorted((server for server, _ in available), key=self._load_key)
+            
+            if policy == "weighted_round_robin" and available:
+                # 平滑加权轮询：每次选中 current 最大者，再减去总权重
+                total_weight = sum(weight for _, weight in available)
+                for server_address, weight in available:
+                    self._state(server_address)["wrr_current"] += weight
+                chosen = max(available, key=lambda item: self._state(item[0])["wrr_current"])[0]
+                self._state(chosen)["wrr_current"] -= total_weight
+                ordered.remove(chosen)
+                ordered.insert(0, chosen)
+            
+            # 不可用的服务器排在最后，作为全部失败时的兜底尝试
+            unavailable.sort(key=lambda server: self._states[server]["cooldown_until"])
+            return ordered + unavailable
+
+
+server_pool = ServerPool()
+
+
+IMAGE_UPLOAD_FORMATS = {
+    "png": (".png", "image/png"),
+    "webp_lossless": (".webp", "image/webp"),
+    # 未压缩的 TIFF，远程 LoadImage 可以直接读取，适合局域网
+    "raw": (".tiff", "image/tiff"),
+}
+
+IMAGE_UPLOAD_ASSUMED_BANDWIDTH = _env_float("POND_REMOTE_ASSUMED_BANDWIDTH_MB", 12.5) * (1 << 20)
+WEBP_MAX_SIDE = 16383
+
+
+def encode_image_bytes(image_np, image_format="png", compress_level=6):
+    if image_np.ndim == 4:
+        arrays = list(image_np)
+    else:
+        arrays = [image_np]
+    
+    frames = []
+    for array in arrays:
+        channels = array.shape[-1] if array.ndim == 3 else 1
+        if channels == 1:
+            frames.append(Image.fromarray(array.reshape(array.shape[:2]), mode="L"))
+        elif channels == 2:
+            # 亮度 + 透明度，远程 LoadImage 会把透明通道读成遮罩
+            frames.append(Image.fromarray(array, mode="LA"))
+        elif channels == 4:
+            frames.append(Image.fromarray(array, mode="RGBA"))
+        else:
+            frames.append(Image.fromarray(array[..., :3], mode="RGB"))
+    
+    compress_level = max(0, min(9, int(compress_level)))
+    if image_format == "webp_lossless":
+        save_args = {
+            "format": "WEBP", "lossless": True,
+            "quality": round(compress_level * 100 / 9), "method": round(compress_level * 6 / 9),
+        }
+    elif image_format == "raw":
+        save_args = {"format": "TIFF"}
+    else:
+        save_args = {"format": "PNG", "compress_level": compress_level}
+    
+    if len(frames) > 1:
+        # 多帧文件，远程 LoadImage 会把所有帧读成一个批次
+        save_args.update(save_all=True, append_images=frames[1:])
+    
+    buffer = io.BytesIO()
+    frames[0].save(buffer, **save_args)
+    return buffer.getvalue()
+
+
+class ImageEncodeAdvisor:
+    
+    # (格式, 压缩级别) -> (压缩后/原始大小, 编码速度 bytes/s) 的先验值，实际编码后用测量值更新
+    PRIORS = {
+        ("raw", 0): (1.0, 1e9),
+        ("webp_lossless", 0): (0.52, 28e6),
+        ("png", 1): (0.55, 18e6),
+        ("png", 6): (0.47, 5e6),
+    }
+    
+    def __init__(self, smoothing=0.3):
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._estimates = dict(self.PRIORS)
+    
+    def record(self, image_format, compress_level, raw_bytes, encoded_bytes, seconds):
+        key = (image_format, compress_level)
+        if key not in self._estimates or raw_bytes <= 0 or seconds <= 0:
+            return
+        ratio = encoded_bytes / raw_bytes
+        speed = raw_bytes / seconds
+        with self._lock:
+            old_ratio, old_speed = self._estimates[key]
+            self._estimates[key] = (
+                old_ratio + self.smoothing * (ratio - old_ratio),
+                old_speed + self.smoothing * (speed - old_speed),
+            )
+    
+    def choose(self, server_address, shape):
+        # 选择编码时间加传输时间最短的格式：带宽高时直接传未压缩数据，带宽低时多花时间压缩
+        bandwidth = transfer_stats.rate(server_address, "upload") or IMAGE_UPLOAD_ASSUMED_BANDWIDTH
+        raw_bytes = int(np.prod(shape))
+        fits_webp = max(shape[-3:-1]) <= WEBP_MAX_SIDE
+        
+        with self._lock:
+            estimates = dict(self._estimates)
+        
+        best, best_cost = ("png", 6), None
+        for (image_format, compress_level), (ratio, speed) in estimates.items():
+            if image_format == "webp_lossless" and not fits_webp:
+                continue
+            cost = raw_bytes / speed + raw_bytes * ratio / bandwidth
+            if best_cost is None or cost < best_cost:
+                best, best_cost = (image_format, compress_level), cost
+        return best
+
+
+image_encode_advisor = ImageEncodeAdvisor()
+
+
+OUTPUT_SIZE_POLICIES = ["resize", "pad"]
+
+
+def batch_target_size(sizes, policy="resize"):
+    # resize: 统一缩放到第一张图的尺寸；pad: 以最大宽高为画布，居中补黑边
+    if policy == "pad":
+        return max(height for height, _ in sizes), max(width for _, width in sizes)
+    return sizes[0]
+
+
+def stack_uint8_images(arrays, policy="resize"):
+    height, width = batch_target_size([array.shape[:2] for array in arrays], policy)
+    needs_padding = policy == "pad" and any(array.shape[:2] != (height, width) for array in arrays)
+    allocate = torch.zeros if needs_padding else torch.empty
+    batch = allocate((len(arrays), height, width, 3), dtype=torch.float32)
+    
+    for index, array in enumerate(arrays):
+        rows, cols = array.shape[:2]
+        if (rows, cols) == (height, width):
+            batch[index].copy_(torch.from_numpy(array))
+        elif policy == "pad":
+            top, left = (height - rows) // 2, (width - cols) // 2
+            batch[index, top:top + rows, left:left + cols].copy_(torch.from_numpy(array))
+        else:
+            resized = Image.fromarray(array).resize((width, height), Image.BILINEAR)
+            batch[index].copy_(torch.from_numpy(np.array(resized)))
+    
+    # 整个批次只做一次 uint8 -> float 的归一化
+    return batch.div_(255.0)
+
+
+def concat_image_batches(images, policy="resize"):
+    height, width = batch_target_size([tuple(image.shape[1:3]) for image in images], policy)
+    fitted = []
+    for image in images:
+        rows, cols = image.shape[1:3]
+        if (rows, cols) == (height, width):
+            fitted.append(image)
+        elif policy == "pad":
+            top, left = (height - rows) // 2, (width - cols) // 2
+            fitted.append(torch.nn.functional.pad(
+                image, (0, 0, left, width - cols - left, top, height - rows - top)
+            ))
+        else:
+            fitted.append(torch.nn.functional.interpolate(
+                image.movedim(-1, 1), size=(height, width), mode="bilinear", align_corners=False
+            ).movedim(1, -1))
+    return torch.cat(fitted, dim=0)
+
+
+VIDEO_CODECS = {
+    "mp4_lossless": ["-c:v", "libx264rgb", "-qp", "0", "-preset", "ultrafast", "-pix_fmt", "rgb24"],
+    "mp4_high": [
+        "-c:v", "libx264", "-crf", "12", "-preset", "veryfast", "-pix_fmt", "yuv420p",
+        "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2",
+    ],
+}
+
+# 远程视频加载节点及其文件名输入字段
+VIDEO_LOADER_FIELDS = {
+    "LoadVideo": "file",
+    "VHS_LoadVideo": "video",
+    "VHS_LoadVideoFFmpeg": "video",
+}
+
+FRAME_DIRECTORY_LOADER_FIELDS = {
+    "VHS_LoadImages": "directory",
+}
+
+
+def find_ffmpeg():
+    path = os.environ.get("POND_REMOTE_FFMPEG") or shutil.which("ffmpeg")
+    if path:
+        return path
+    try:
+        import imageio_ffmpeg
+        return imageio_ffmpeg.get_ffmpeg_exe()
+    except Exception:
+        return None
+
+
+def image_to_uint8(image):
+    return image.detach().clamp(0, 1).mul_(255).round_().to(torch.uint8).cpu().numpy()
+
+
+def frames_to_uint8(frames):
+    return image_to_uint8(frames[..., :3])
+
+
+VIDEO_ENCODE_JOIN_TIMEOUT = 10.0
+
+
+def encode_video_stream(frames, codec, fps, chunk_size=1 << 20):
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg not found")
+    
+    count, height, width = frames.shape[:3]
+    cmd = [
+        ffmpeg, "-v", "error",
+        "-f", "rawvideo", "-pix_fmt", "rgb24", "-s", f"{width}x{height}", "-r", str(fps),
+        "-i", "pipe:0",
+        *VIDEO_CODECS[codec],
+        # 分片 MP4 不需要回写文件头，可以直接从管道边编码边上传
+        "-movflags", "frag_keyframe+empty_moov",
+        "-f", "mp4", "pipe:1",
+    ]
+    proc = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    
+    def feed_frames():
+        try:
+            for index in range(count):
+                proc.stdin.write(frames_to_uint8(frames[index]).tobytes())
+        except (BrokenPipeError, OSError):
+            pass
+        finally:
+            try:
+                proc.stdin.close()
+            except OSError:
+                pass
+    
+    writer = threading.Thread(target=feed_frames, name="pond_remote_encode", daemon=True)
+    writer.start()
+    finished = False
+    try:
+        while True:
+            chunk = proc.stdout.read(chunk_size)
+            if not chunk:
+                finished = True
+                break
+            yield chunk
+    finally:
+        if not finished:
+            # 消费方提前停止（如上传被服务器中断）：ffmpeg 卡在写满的 stdout 上，写入线程又卡在 stdin 上，
+            # 不先结束 ffmpeg 就永远等不到写入线程
+            proc.kill()
+        proc.stdout.close()
+        writer.join(VIDEO_ENCODE_JOIN_TIMEOUT)
+        stderr = proc.stderr.read()
+        proc.stderr.close()
+        returncode = proc.wait()
+    
+    if returncode != 0:
+        raise RuntimeError(f"ffmpeg exited with {returncode}: {stderr.decode(errors='ignore').strip()}")
+
+
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mov', '.webm', '.mkv', '.gif')
+
+
+def fit_frame_size(width, height, max_side=0):
+    if max_side <= 0 or max(width, height) <= max_side:
+        return width, height
+    scale = max_side / max(width, height)
+    return max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+
+
+def decode_video_file(path, frame_stride=1, max_frames=0, max_side=0):
+    import cv2
+
+    frame_stride = max(1, int(frame_stride))
+    max_frames = max(0, int(max_frames))
+    cap = cv2.VideoCapture(path)
+    try:
+        # 帧数只是容器里的估计值，按它预分配，实际解码数量不同时再截断或追加
+        total = int(cap.get(cv2.CAP_PROP_FRAME_COUNT) or 0)
+        expected = (total + frame_stride - 1) // frame_stride if total > 0 else 0
+        if max_frames:
+            expected = min(expected, max_frames) if expected else max_frames
+
+        video = None
+        overflow = []
+        size = None
+        count = 0
+        index = 0
+        while not max_frames or count < max_frames:
+            if index % frame_stride:
+                # 跳过的帧只 grab 不做颜色转换
+                if not cap.grab():
+                    break
+                index += 1
+                continue
+            ret, frame = cap.read()
+            if not ret:
+                break
+            index += 1
+
+            if size is None:
+                size = fit_frame_size(frame.shape[1], frame.shape[0], max_side)
+                if expected:
+                    video = torch.empty((expected, size[1], size[0], 3), dtype=torch.float32)
+            if (frame.shape[1], frame.shape[0]) != size:
+                frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+            rgb = torch.from_numpy(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+
+            if video is not None and count < video.shape[0]:
+                video[count].copy_(rgb).div_(255.0)
+            else:
+                overflow.append(rgb.float().div_(255.0))
+            count += 1
+    finally:
+        cap.release()
+
+    return _collect_frames(video, overflow, count)
+
+
+def _collect_frames(video, overflow, count):
+    if count == 0:
+        return None
+    if video is None:
+        return torch.stack(overflow, dim=0)
+    if overflow:
+        return torch.cat([video, torch.stack(overflow, dim=0)], dim=0)
+    if count < video.shape[0]:
+        return video[:count].clone()
+    return video
+
+
+def probe_media(ffmpeg, path):
+    # imageio-ffmpeg 不带 ffprobe，直接解析 ffmpeg -i 打印的流信息
+    result = subprocess.run(
+        [ffmpeg, "-hide_banner", "-i", path],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, timeout=30
+    )
+    text = result.stderr.decode(errors="ignore")
+    info = {"width": 0, "height": 0, "fps": 0.0, "duration": 0.0, "has_audio": False, "sample_rate": 0}
+    
+    duration = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", text)
+    if duration:
+        hours, minutes, seconds = duration.groups()
+        info["duration"] = int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+    
+    for line in text.splitlines():
+        if "Stream #" not in line:
+            continue
+        if "Video:" in line and not info["width"]:
+            size = re.search(r"\b(\d{2,5})x(\d{2,5})\b", line)
+            if size:
+                info["width"], info["height"] = int(size.group(1)), int(size.group(2))
+            fps = re.search(r"(\d+(?:\.\d+)?) (?:fps|tbr)", line)
+            if fps:
+                info["fps"] = float(fps.group(1))
+        elif "Audio:" in line and not info["has_audio"]:
+            info["has_audio"] = True
+            rate = re.search(r"(\d+) Hz", line)
+            if rate:
+                info["sample_rate"] = int(rate.group(1))
+    
+    # ffmpeg 解码时会按旋转元数据自动转正，宽高需要对调
+    rotation = re.search(r"rotation of (-?\d+(?:\.\d+)?) degrees", text)
+    if rotation and round(abs(float(rotation.group(1)))) % 180 == 90:
+        info["width"], info["height"] = info["height"], info["width"]
+    
+    return info
+
+
+def read_raw_frames(stream, width, height, expected=0):
+    frame_bytes = width * height * 3
+    buffer = np.empty((height, width, 3), dtype=np.uint8)
+    view = memoryview(buffer.reshape(-1))
+    frame = torch.from_numpy(buffer)
+    video = torch.empty((expected, height, width, 3), dtype=torch.float32) if expected else None
+    overflow = []
+    count = 0
+    
+    while True:
+        filled = 0
+        while filled < frame_bytes:
+            size = stream.readinto(view[filled:])
+            if not size:
+                break
+            filled += size
+        if filled < frame_bytes:
+            break
+        
+        if video is not None and count < video.shape[0]:
+            video[count].copy_(frame).div_(255.0)
+        else:
+            overflow.append(frame.float().div_(255.0))
+        count += 1
+    
+    return _collect_frames(video, overflow, count)
+
+
+def pcm_to_audio(data, sample_rate, channels=2):
+    samples = np.frombuffer(data, dtype=np.int16)
+    usable = len(samples) - len(samples) % channels
+    if usable == 0:
+        return None
+    waveform = samples[:usable].reshape(-1, channels).T.astype(np.float32) / 32768.0
+    return {"waveform": torch.from_numpy(waveform).unsqueeze(0), "sample_rate": sample_rate}
+
+
+def decode_media_file(path, frame_stride=1, max_frames=0, max_side=0):
+    ffmpeg = find_ffmpeg()
+    info = probe_media(ffmpeg, path) if ffmpeg else None
+    if not info or not info["width"] or not info["height"]:
+        return decode_video_file(path, frame_stride, max_frames, max_side), None
+    
+    frame_stride = max(1, int(frame_stride))
+    max_frames = max(0, int(max_frames))
+    width, height = fit_frame_size(info["width"], info["height"], max_side)
+    
+    expected = 0
+    if info["duration"] and info["fps"]:
+        expected = (int(round(info["duration"] * info["fps"])) + frame_stride - 1) // frame_stride
+    if max_frames:
+        expected = min(expected, max_frames) if expected else max_frames
+    
+    # 抽帧和缩放交给 ffmpeg 滤镜完成，输出的原始帧已经是目标尺寸
+    filters = []
+    if frame_stride > 1:
+        filters.append(f"select=not(mod(n\\,{frame_stride}))")
+    if (width, height) != (info["width"], info["height"]):
+        filters.append(f"scale={width}:{height}:flags=area")
+    
+    cmd = [ffmpeg, "-v", "error", "-i", path, "-map", "0:v:0"]
+    if filters:
+        cmd += ["-vf", ",".join(filters)]
+    if max_frames:
+        cmd += ["-frames:v", str(max_frames)]
+    cmd += ["-vsync", "0", "-f", "rawvideo", "-pix_fmt", "rgb24", "pipe:1"]
+    
+    sample_rate = info["sample_rate"] or 44100
+    audio_args = ["-map", "0:a:0", "-f", "s16le", "-acodec", "pcm_s16le", "-ac", "2", "-ar", str(sample_rate)]
+    
+    # POSIX 下音频从额外的管道输出，一次读文件同时得到画面和音频；Windows 不支持 pass_fds，音频单独解码
+    single_pass = info["has_audio"] and os.name == "posix"
+    audio_read = audio_write = None
+    if single_pass:
+        audio_read, audio_write = os.pipe()
+        cmd += [*audio_args, f"pipe:{audio_write}"]
+    
+    try:
+        proc = subprocess.Popen(
+            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+            pass_fds=(audio_write,) if single_pass else ()
+        )
+    finally:
+        if audio_write is not None:
+            os.close(audio_write)
+    
+    collected = {}
+    
+    def drain(name, stream):
+        try:
+            collected[name] = stream.read()
+        finally:
+            stream.close()
+    
+    readers = [threading.Thread(target=drain, args=("stderr", proc.stderr), daemon=True)]
+    if single_pass:
+        readers.append(threading.Thread(target=drain, args=("audio", os.fdopen(audio_read, "rb")), daemon=True))
+    for reader in readers:
+        reader.start()
+    
+    try:
+        video = read_raw_frames(proc.stdout, width, height, expected)
+    finally:
+        proc.stdout.close()
+        for reader in readers:
+            reader.join()
+        returncode = proc.wait()
+    
+    if video is None:
+        if returncode != 0:
+            raise RuntimeError(f"ffmpeg exited with {returncode}: {collected.get('stderr', b'').decode(errors='ignore').strip()}")
+        return None, None
+    
+    audio = None
+    if single_pass:
+        audio = pcm_to_audio(collected.get("audio", b""), sample_rate)
+    elif info["has_audio"]:
+        result = subprocess.run(
+            [ffmpeg, "-v", "error", "-i", path, *audio_args, "pipe:1"],
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=60
+        )
+        if result.returncode == 0:
+            audio = pcm_to_audio(result.stdout, sample_rate)
+    
+    return video, audio
+
+
+# 扩展名, MIME, ffmpeg 编码参数；wav 不需要 ffmpeg
+AUDIO_UPLOAD_FORMATS = {
+    "wav": (".wav", "audio/wav", None),
+    "flac": (".flac", "audio/flac", ["-c:a", "flac", "-sample_fmt", "s32", "-f", "flac"]),
+    "opus": (".ogg", "audio/ogg", ["-c:a", "libopus", "-b:a", f"{_env_int('POND_REMOTE_OPUS_BITRATE_KBPS', 192)}k", "-f", "ogg"]),
+}
+
+AUDIO_UPLOAD_ROUTES = ("image", "audio")
+
+
+def audio_upload_format(audio_format):
+    if audio_format not in AUDIO_UPLOAD_FORMATS:
+        return "wav"
+    if AUDIO_UPLOAD_FORMATS[audio_format][2] is not None and find_ffmpeg() is None:
+        logger.warning("未找到 ffmpeg，音频改用 WAV 上传")
+        return "wav"
+    return audio_format
+
+
+def encode_wav_bytes(samples, sample_rate):
+    # samples: (channels, n) float32，写成 32 位浮点 WAV，与 torchaudio.save 的默认输出一致
+    channels = samples.shape[0]
+    data = np.ascontiguousarray(samples.T, dtype="<f4").tobytes()
+    header = struct.pack(
+        "<4sI4s4sIHHIIHH4sI",
+        b"RIFF", 36 + len(data), b"WAVE",
+        b"fmt ", 16, 3, channels, sample_rate, sample_rate * channels * 4, channels * 4, 32,
+        b"data", len(data),
+    )
+    return header + data
+
+
+def encode_audio_bytes(waveform, sample_rate, audio_format="wav"):
+    samples = waveform.detach().cpu().float().numpy()
+    wav_bytes = encode_wav_bytes(samples, int(sample_rate))
+    codec_args = AUDIO_UPLOAD_FORMATS[audio_format][2]
+    if codec_args is None:
+        return wav_bytes
+    
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is None:
+        raise RuntimeError("ffmpeg not found")
+    result = subprocess.run(
+        [ffmpeg, "-v", "error", "-f", "wav", "-i", "pipe:0", *codec_args, "pipe:1"],
+        input=wav_bytes, stdout=subprocess.PIPE, stderr=subprocess.PIPE, timeout=120
+    )
+    if result.returncode != 0 or not result.stdout:
+        raise RuntimeError(f"ffmpeg exited with {result.returncode}: {result.stderr.decode(errors='ignore').strip()}")
+    return result.stdout
+
+
+def decode_wav_bytes(data):
+    if len(data) < 12 or data[:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    
+    view = memoryview(data)
+    position = 12
+    fmt = None
+    payload = None
+    while position + 8 <= len(data):
+        chunk_id = data[position:position + 4]
+        size = struct.unpack_from("<I", data, position + 4)[0]
+        start = position + 8
+        if chunk_id == b"fmt ":
+            tag, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", data, start)
+            if tag == 0xFFFE and size >= 26:
+                tag = struct.unpack_from("<H", data, start + 24)[0]
+            fmt = (tag, channels, sample_rate, bits)
+        elif chunk_id == b"data":
+            # ffmpeg 输出到管道时长度字段无效，取到末尾
+            payload = view[start:min(len(data), start + size)]
+            break
+        position = start + size + (size & 1)
+    
+    if fmt is None or payload is None:
+        return None
+    
+    tag, channels, sample_rate, bits = fmt
+    width = bits // 8
+    usable = len(payload) - len(payload) % (width * channels)
+    if channels == 0 or usable == 0:
+        return None
+    raw = np.frombuffer(payload[:usable], dtype=np.uint8)
+    
+    if tag == 3 and bits in (32, 64):
+        samples = raw.view("<f4" if bits == 32 else "<f8").astype(np.float32)
+    elif tag == 1 and bits == 8:
+        samples = (raw.astype(np.float32) - 128.0) / 128.0
+    elif tag == 1 and bits == 16:
+        samples = raw.view("<i2").astype(np.float32) / 32768.0
+    elif tag == 1 and bits == 24:
+        triples = raw.reshape(-1, 3).astype(np.int32)
+        values = triples[:, 0] | (triples[:, 1] << 8) | (triples[:, 2] << 16)
+        values = np.where(values >= 1 << 23, values - (1 << 24), values)
+        samples = values.astype(np.float32) / float(1 << 23)
+    elif tag == 1 and bits == 32:
+        samples = raw.view("<i4").astype(np.float32) / float(1 << 31)
+    else:
+        return None
+    
+    waveform = np.ascontiguousarray(samples.reshape(-1, channels).T)
+    return {"waveform": torch.from_numpy(waveform).unsqueeze(0), "sample_rate": sample_rate}
+
+
+def decode_audio_bytes(data, ext=""):
+    if ext in ("", ".wav"):
+        audio = decode_wav_bytes(data)
+        if audio is not None:
+            return audio
+    
+    # 其他格式由 ffmpeg 在管道中转成浮点 WAV，没有 ffmpeg 时交给 torchaudio
+    ffmpeg = find_ffmpeg()
+    if ffmpeg is not None:
+        result = subprocess.run(
+            [ffmpeg, "-v", "error", "-i", "pipe:0", "-vn", "-c:a", "pcm_f32le", "-f", "wav", "pipe:1"],
+            input=bytes(data), stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=120
+        )
+        if result.returncode == 0:
+            audio = decode_wav_bytes(result.stdout)
+            if audio is not None:
+                return audio
+    
+    import torchaudio
+    waveform, sample_rate = torchaudio.load(io.BytesIO(data), format=ext.lstrip(".") or None)
+    if waveform.dim() == 2:
+        waveform = waveform.unsqueeze(0)
+    return {"waveform": waveform, "sample_rate": sample_rate}
+
+
+# 与前端解析工作流时使用的节点表一致
+INPUT_NODE_TYPES = {
+    "LoadImage": "image",
+    "LoadVideo": "video",
+    "VHS_LoadVideo": "video",
+    "VHS_LoadVideoFFmpeg": "video",
+    "VHS_LoadImages": "video",
+    "LoadAudio": "audio",
+    "CR Prompt Text": "text",
+    "easy showAnything": "text",
+    "Text": "text",
+}
+
+OUTPUT_NODE_TYPES = {
+    "SaveImage": "image",
+    "PreviewImage": "image",
+    "VHS_VideoCombine": "video",
+    "easy showAnything": "text",
+    "SaveAudio": "audio",
+}
+
+
+class WorkflowTemplate:
+    
+    def __init__(self, nodes):
+        # 解析后的工作流作为只读模板，所有任务共享，任何时候都不能原地修改
+        self.nodes = nodes
+        self.is_api_format = False
+        self.input_nodes = {}
+        self.output_nodes = {}
+        self.class_types = frozenset()
+        
+        if isinstance(nodes, dict):
+            first_key = next(iter(nodes.keys()), None)
+            self.is_api_format = bool(first_key and first_key.isdigit())
+        
+        if self.is_api_format:
+            for node_id, node in nodes.items():
+                class_type = node.get("class_type") if isinstance(node, dict) else None
+                if class_type in INPUT_NODE_TYPES:
+                    self.input_nodes[node_id] = class_type
+                if class_type in OUTPUT_NODE_TYPES:
+                    self.output_nodes[node_id] = class_type
+            self.class_types = frozenset(
+                node["class_type"] for node in nodes.values() if isinstance(node, dict) and node.get("class_type")
+            )
+    
+    def instantiate(self):
+        return WorkflowInstance(self.nodes, self)
+
+
+class WorkflowInstance(dict):
+    
+    # 每次运行使用的工作流：只复制顶层字典，节点与模板共享；打补丁时替换成新的节点字典（写时复制）
+    def __init__(self, nodes, template=None):
+        super().__init__(nodes)
+        self.template = template
+
+
+class WorkflowTemplateCache:
+    
+    def __init__(self, max_entries=None):
+        self.max_entries = max_entries if max_entries is not None else _env_int("POND_REMOTE_WORKFLOW_CACHE_SIZE", 32)
+        self._lock = threading.Lock()
+        self._templates = OrderedDict()
+    
+    def get(self, workflow_json_str):
+        key = hashlib.sha256(workflow_json_str.encode()).hexdigest()
+        with self._lock:
+            template = self._templates.get(key)
+            if template is not None:
+                self._templates.move_to_end(key)
+                return template
+        
+        template = WorkflowTemplate(json.loads(workflow_json_str))
+        
+        with self._lock:
+            self._templates[key] = template
+            self._templates.move_to_end(key)
+            while len(self._templates) > max(1, self.max_entries):
+                self._templates.popitem(last=False)
+        return template
+
+
+workflow_templates = WorkflowTemplateCache()
+
+
+class RemoteExecutionError(Exception):
+    
+    # kind 用于指标中的错误分类；status 为 HTTP 错误的状态码
+    def __init__(self, message="", kind="error", status=None):
+        super().__init__(message)
+        self.kind = kind
+        self.status = status
+
+
+class RemoteJob:
+    
+    # 已提交到远程的一个任务；结果缓存命中时只带 cached_outputs
+    def __init__(self, server_address=None, prompt_id=None, workflow=None, options=None, cache_key=None,
+                 report=None, cached_outputs=None, job_key=None, reattached=False):
+        self.server_address = server_address
+        self.prompt_id = prompt_id
+        self.workflow = workflow
+        self.options = options or {}
+        self.cache_key = cache_key
+        self.report = report if report is not None else RunReport()
+        self.cached_outputs = cached_outputs
+        self.job_key = job_key
+        self.reattached = reattached
+        self.submitted_at = time.time()
+        self._released = server_address is None
+    
+    def release(self):
+        # 归还在服务器池中占用的在途任务计数，可重复调用
+        if not self._released:
+            self._released = True
+            server_pool.release(self.server_address)
+
+
+class RemoteJobHandle:
+    
+    # RemoteWorkflowSubmit 输出的 REMOTE_JOB：批量拆分时包含多个子任务
+    def __init__(self, jobs=None, options=None, report=None, error=None):
+        self.jobs = jobs or []
+        self.options = options or {}
+        self.report = report if report is not None else RunReport()
+        self.error = error
+
 
 class RemoteWorkflowExecutor:
     
     def __init__(self):
         self.client_id = str(time.time())
-        self.workflow_cache = {}
         self.hide_ip = True
+        self.last_upload_report = []
+        self.last_run_report = None
 
     def mask_ip(self, server_address):
         if not self.hide_ip:
@@ -51,6 +2519,19 @@ class RemoteWorkflowExecutor:
                 "text_1": ("STRING", {"forceInput": True}),
                 "audio_1": ("AUDIO",),
                 "video_1": ("IMAGE",),
+                "video_codec": (["mp4_lossless", "mp4_high", "png_sequence"], {"default": "mp4_lossless"}),
+                "video_fps": ("FLOAT", {"default": 24.0, "min": 1.0, "max": 120.0, "step": 0.5}),
+                "batch_mode": (["off", "split"], {"default": "off"}),
+                "batch_chunk_size": ("INT", {"default": 1, "min": 1, "max": 256}),
+                "max_parallel_jobs": ("INT", {"default": 4, "min": 1, "max": 64}),
+                "image_format": (["auto", "png", "webp_lossless", "raw"], {"default": "auto"}),
+                "image_compress_level": ("INT", {"default": 6, "min": 0, "max": 9}),
+                "output_size_policy": (OUTPUT_SIZE_POLICIES, {"default": "resize"}),
+                "use_result_cache": ("BOOLEAN", {"default": False}),
+                "output_frame_stride": ("INT", {"default": 1, "min": 1, "max": 100}),
+                "output_max_frames": ("INT", {"default": 0, "min": 0, "max": 100000}),
+                "output_max_side": ("INT", {"default": 0, "min": 0, "max": 16384}),
+                "audio_format": (list(AUDIO_UPLOAD_FORMATS), {"default": "wav"}),
             },
             "hidden": {
                 "unique_id": "UNIQUE_ID",
@@ -58,21 +2539,25 @@ class RemoteWorkflowExecutor:
             }
         }
     
-    RETURN_TYPES = ("IMAGE", "STRING", "AUDIO", "IMAGE")
-    RETURN_NAMES = ("output_image", "output_text", "output_audio", "output_video")
+    RETURN_TYPES = ("IMAGE", "STRING", "AUDIO", "IMAGE", "STRING")
+    RETURN_NAMES = ("output_image", "output_text", "output_audio", "output_video", "run_report")
     FUNCTION = "execute_remote"
     CATEGORY = "🐳Pond_Owner/IP"
     
-    def load_workflow(self, workflow_json_str):
-        if workflow_json_str in self.workflow_cache:
-            return self.workflow_cache[workflow_json_str]
-        
+    def load_template(self, workflow_json_str):
         try:
-            workflow = json.loads(workflow_json_str)
-            self.workflow_cache[workflow_json_str] = workflow
-            return workflow
+            return workflow_templates.get(workflow_json_str)
         except Exception as e:
+            logger.debug("workflow load failed: %s", e)
             return None
+    
+    def load_workflow(self, workflow_json_str):
+        template = self.load_template(workflow_json_str)
+        if template is None:
+            return None
+        if not isinstance(template.nodes, dict):
+            return copy.deepcopy(template.nodes)
+        return template.instantiate()
 
     def get_workflow_nodes(self, workflow):
         nodes_info = []
@@ -94,116 +2579,172 @@ class RemoteWorkflowExecutor:
     
     def test_remote_connection(self, server_address):
         try:
-            url = f"http://{server_address}/system_stats"
-            response = requests.get(url, timeout=5)
+            return server_pool.is_reachable(server_address)
+        except:
+            return False
+    
+    def remote_file_exists(self, server_address, remote_name, folder_type="input"):
+        if "/" in remote_name:
+            subfolder, filename = remote_name.rsplit("/", 1)
+        else:
+            subfolder, filename = "", remote_name
+        try:
+            url = f"http://{server_address}/view"
+            params = {"filename": filename, "subfolder": subfolder, "type": folder_type}
+            response = connection_manager.session(server_address).head(url, params=params, timeout=connection_manager.timeout("probe"))
             return response.status_code == 200
         except:
             return False
     
-    def upload_audio_to_remote(self, server_address, audio_data):
+    def _cached_upload(self, server_address, content_key, filename, upload_fn, marker=None):
+        # marker 用于目录类上传：检查目录下的某个文件是否存在
+        def exists(remote_name):
+            return self.remote_file_exists(server_address, f"{remote_name}/{marker}" if marker else remote_name)
+        
+        with upload_cache.upload_lock(server_address, content_key):
+            entry = upload_cache.get(server_address, content_key)
+            if entry is not None:
+                if time.time() - entry["verified"] < upload_cache.verify_ttl:
+                    return entry["remote_name"]
+                if exists(entry["remote_name"]):
+                    upload_cache.mark_verified(server_address, content_key)
+                    return entry["remote_name"]
+                upload_cache.invalidate(server_address, content_key)
+            
+            # 文件名由内容决定，其他任务或之前的会话可能已上传过同一文件
+            expected_name = f"{UPLOAD_SUBFOLDER}/{filename}" if UPLOAD_SUBFOLDER else filename
+            if exists(expected_name):
+                upload_cache.put(server_address, content_key, expected_name)
+                return expected_name
+            
+            remote_name = upload_fn(filename)
+            if remote_name:
+                upload_cache.put(server_address, content_key, remote_name)
+            return remote_name
+    
+    def upload_audio_to_remote(self, server_address, audio_data, options=None, content_hash=None):
         try:
             waveform = audio_data.get('waveform')
             sample_rate = audio_data.get('sample_rate', 44100)
             
             if waveform is None:
-                return None
+                raise RemoteExecutionError("音频输入缺少 waveform", "invalid_input")
             
             if waveform.dim() == 3:
                 waveform = waveform.squeeze(0)
             elif waveform.dim() == 1:
                 waveform = waveform.unsqueeze(0)
             elif waveform.dim() != 2:
-                return None
-            
-            if waveform.dim() != 2:
-                return None
-            
-            import tempfile
-            import uuid
-            with tempfile.NamedTemporaryFile(suffix='.wav', delete=False) as tmp_file:
-                tmp_path = tmp_file.name
-            
-            import torchaudio
-            torchaudio.save(tmp_path, waveform.cpu(), sample_rate)
-            
-            unique_filename = f"audio_{uuid.uuid4().hex[:8]}.wav"
-            
-            try:
-                with open(tmp_path, 'rb') as f:
-                    files = {'image': (unique_filename, f, 'audio/wav')}
-                    data = {'overwrite': 'true', 'type': 'input'}
-                    
-                    url = f"http://{server_address}/upload/image"
-                    response = requests.post(url, files=files, data=data, timeout=30)
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    returned_name = result.get('name', unique_filename)
-                    subfolder = result.get('subfolder', '')
-                    
-                    try:
-                        os.unlink(tmp_path)
-                    except:
-                        pass
-                    
-                    if subfolder:
-                        return f"{subfolder}/{returned_name}"
-                    else:
-                        return returned_name
-            except:
-                pass
+                raise RemoteExecutionError(f"不支持的音频形状: {tuple(waveform.shape)}", "invalid_input")
             
+            audio_format = audio_upload_format((options or {}).get("audio_format", "wav"))
+            if content_hash is not None:
+                content_key = derived_content_key(content_hash, "audio", audio_format)
+            else:
+                content_key = tensor_content_hash(waveform, sample_rate, audio_format)
+        except Exception as e:
+            note_error("upload", e)
+            return None
+        
+        return self._cached_upload(
+            server_address, content_key, content_filename(content_key, AUDIO_UPLOAD_FORMATS[audio_format][0]),
+            lambda filename: self._upload_audio_waveform(server_address, waveform, sample_rate, filename, audio_format)
+        )
+    
+    def _upload_audio_waveform(self, server_address, waveform, sample_rate, unique_filename, audio_format="wav"):
+        try:
+            started = time.perf_counter()
+            audio_bytes = encode_audio_bytes(waveform, sample_rate, audio_format)
+            note_io("encode_seconds", time.perf_counter() - started)
+        except Exception as e:
+            logger.warning("音频编码失败: %s", e)
+            note_error("encode", e, file=unique_filename)
+            return None
+        
+        content_type = AUDIO_UPLOAD_FORMATS[audio_format][1]
+        for route in connection_manager.ordered_routes(server_address, "audio_upload", AUDIO_UPLOAD_ROUTES):
+            started = time.perf_counter()
             try:
-                with open(tmp_path, 'rb') as f:
-                    files = {'audio': (unique_filename, f, 'audio/wav')}
+                if route == "image":
+                    files = {'image': (unique_filename, audio_bytes, content_type)}
+                    data = {'overwrite': 'true', 'type': 'input', 'subfolder': UPLOAD_SUBFOLDER}
+                else:
+                    files = {'audio': (unique_filename, audio_bytes, content_type)}
                     data = {'overwrite': 'true'}
-                    
-                    url = f"http://{server_address}/upload/audio"
-                    response = requests.post(url, files=files, data=data, timeout=30)
                 
-                if response.status_code == 200:
-                    try:
-                        os.unlink(tmp_path)
-                    except:
-                        pass
-                    return unique_filename
-            except:
-                pass
-            
-            try:
-                os.unlink(tmp_path)
-            except:
-                pass
-            
-            return None
+                url = f"http://{server_address}/upload/{route}"
+                response = connection_manager.session(server_address).post(url, files=files, data=data, timeout=connection_manager.timeout("upload"))
+                if response.status_code != 200:
+                    note_error("upload", RemoteExecutionError(f"/upload/{route}: HTTP {response.status_code}", "http", response.status_code), file=unique_filename)
+                    continue
+                remote_name = self._remote_name_from_response(response, unique_filename) if route == "image" else unique_filename
+            except Exception as e:
+                note_error("upload", e, file=unique_filename)
+                continue
             
-        except Exception as e:
-            return None
+            upload_seconds = time.perf_counter() - started
+            transfer_stats.record(server_address, "upload", len(audio_bytes), upload_seconds)
+            note_io("upload_bytes", len(audio_bytes))
+            note_io("upload_seconds", upload_seconds)
+            connection_manager.remember_route(server_address, "audio_upload", route)
+            return remote_name
+        
+        return None
     
-    def upload_image_to_remote(self, server_address, image_tensor):
+    def upload_image_to_remote(self, server_address, image_tensor, all_frames=False, options=None, content_hash=None):
+        options = options or {}
         try:
-            if image_tensor.dim() == 4:
+            if image_tensor.dim() == 4 and all_frames and image_tensor.shape[0] > 1:
+                # 多帧文件，远程 LoadImage 会把所有帧读成一个批次
+                img_array = image_tensor
+            elif image_tensor.dim() == 4:
                 img_array = image_tensor[0]
             elif image_tensor.dim() == 3:
                 img_array = image_tensor
             else:
-                return None
-            
-            img_np = (img_array.cpu().numpy() * 255).astype(np.uint8)
-            img_pil = Image.fromarray(img_np, mode='RGB')
+                raise RemoteExecutionError(f"不支持的图像形状: {tuple(image_tensor.shape)}", "invalid_input")
             
-            img_buffer = io.BytesIO()
-            img_pil.save(img_buffer, format='PNG')
-            img_bytes = img_buffer.getvalue()
-            
-            import uuid
-            unique_filename = f"input.png"
+            # 所有格式都是无损的，缓存按像素内容命中，不区分编码方式
+            if content_hash is not None:
+                # 计划中的哈希覆盖整个批次，按取用的帧区分
+                frames_used = "all" if img_array is image_tensor else "first"
+                content_key = derived_content_key(content_hash, "image", frames_used)
+            else:
+                content_key = tensor_content_hash(img_array)
+        except Exception as e:
+            note_error("upload", e)
+            return None
+        
+        image_format = options.get("image_format", "auto")
+        compress_level = options.get("image_compress_level", 6)
+        if image_format not in IMAGE_UPLOAD_FORMATS:
+            image_format, compress_level = image_encode_advisor.choose(server_address, tuple(img_array.shape))
+        
+        return self._cached_upload(
+            server_address, content_key, content_filename(content_key, IMAGE_UPLOAD_FORMATS[image_format][0]),
+            lambda filename: self._upload_image_array(
+                server_address, image_to_uint8(img_array), filename, image_format, compress_level
+            )
+        )
+    
+    def _upload_image_array(self, server_address, img_np, unique_filename, image_format="png", compress_level=6):
+        try:
+            started = time.perf_counter()
+            img_bytes = encode_image_bytes(img_np, image_format, compress_level)
+            encode_seconds = time.perf_counter() - started
+            image_encode_advisor.record(image_format, compress_level, img_np.nbytes, len(img_bytes), encode_seconds)
+            note_io("encode_seconds", encode_seconds)
             
-            files = {'image': (unique_filename, img_bytes, 'image/png')}
-            data = {'overwrite': 'true', 'type': 'input'}
+            files = {'image': (unique_filename, img_bytes, IMAGE_UPLOAD_FORMATS[image_format][1])}
+            data = {'overwrite': 'true', 'type': 'input', 'subfolder': UPLOAD_SUBFOLDER}
             
             url = f"http://{server_address}/upload/image"
-            response = requests.post(url, files=files, data=data, timeout=30)
+            started = time.perf_counter()
+            response = connection_manager.session(server_address).post(url, files=files, data=data, timeout=connection_manager.timeout("upload"))
+            upload_seconds = time.perf_counter() - started
+            transfer_stats.record(server_address, "upload", len(img_bytes), upload_seconds)
+            note_io("upload_bytes", len(img_bytes))
+            note_io("upload_seconds", upload_seconds)
             
             if response.status_code == 200:
                 result = response.json()
@@ -215,531 +2756,1098 @@ class RemoteWorkflowExecutor:
                 else:
                     return uploaded_name
             else:
+                note_error("upload", RemoteExecutionError(f"HTTP {response.status_code}", "http", response.status_code), file=unique_filename)
                 return None
                 
         except Exception as e:
+            note_error("upload", e, file=unique_filename)
             return None
     
-    def modify_workflow_input(self, workflow, node_id, input_type, input_value, server_address):
-        if node_id not in workflow:
-            return workflow
+    def _remote_name_from_response(self, response, default_name):
+        if response.status_code != 200:
+            return None
+        result = response.json()
+        uploaded_name = result.get('name', default_name)
+        subfolder = result.get('subfolder', '')
+        if subfolder:
+            return f"{subfolder}/{uploaded_name}"
+        return uploaded_name
+    
+    def _stream_upload(self, server_address, filename, content_type, chunks, subfolder):
+        boundary = uuid.uuid4().hex
+        sent = [0]
+        
+        def counted(chunks):
+            for chunk in chunks:
+                sent[0] += len(chunk)
+                yield chunk
+        
+        def body():
+            for name, value in (("overwrite", "true"), ("type", "input"), ("subfolder", subfolder)):
+                yield (
+                    f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+                ).encode()
+            yield (
+                f'--{boundary}\r\nContent-Disposition: form-data; name="image"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            ).encode()
+            yield from counted(chunks)
+            yield f"\r\n--{boundary}--\r\n".encode()
+        
+        url = f"http://{server_address}/upload/image"
+        started = time.perf_counter()
+        try:
+            response = connection_manager.session(server_address).post(
+                url, data=body(), headers={"Content-Type": f"multipart/form-data; boundary={boundary}"},
+                timeout=connection_manager.timeout("upload")
+            )
+        finally:
+            # 请求中途失败时立即关闭数据源（如结束 ffmpeg），不等垃圾回收
+            if hasattr(chunks, "close"):
+                chunks.close()
+        # 边编码边上传，编码时间包含在上传时间里
+        note_io("upload_bytes", sent[0])
+        note_io("upload_seconds", time.perf_counter() - started)
+        if response.status_code != 200:
+            note_error("upload", RemoteExecutionError(f"HTTP {response.status_code}", "http", response.status_code), file=filename)
+        return self._remote_name_from_response(response, filename)
+    
+    def upload_video_to_remote(self, server_address, frames, codec="mp4_lossless", fps=24.0, content_hash=None):
+        try:
+            if frames.dim() == 3:
+                frames = frames.unsqueeze(0)
+            elif frames.dim() != 4:
+                raise RemoteExecutionError(f"不支持的视频形状: {tuple(frames.shape)}", "invalid_input")
+            
+            if codec not in VIDEO_CODECS:
+                codec = "mp4_lossless"
+            if content_hash is not None:
+                content_key = derived_content_key(content_hash, "video", codec, fps)
+            else:
+                content_key = tensor_content_hash(frames, codec, fps)
+        except Exception as e:
+            note_error("upload", e)
+            return None
+        
+        def upload(filename):
+            try:
+                return self._stream_upload(
+                    server_address, filename, "video/mp4", encode_video_stream(frames, codec, fps), UPLOAD_SUBFOLDER
+                )
+            except Exception as e:
+                logger.warning("video upload to %s failed: %s", self.mask_ip(server_address), e)
+                note_error("upload", e, file=filename)
+                return None
+        
+        return self._cached_upload(server_address, content_key, content_filename(content_key, ".mp4"), upload)
+    
+    def upload_frame_sequence_to_remote(self, server_address, frames, content_hash=None):
+        try:
+            if frames.dim() == 3:
+                frames = frames.unsqueeze(0)
+            elif frames.dim() != 4:
+                raise RemoteExecutionError(f"不支持的帧序列形状: {tuple(frames.shape)}", "invalid_input")
+            if content_hash is not None:
+                content_key = derived_content_key(content_hash, "frames")
+            else:
+                content_key = tensor_content_hash(frames)
+        except Exception as e:
+            note_error("upload", e)
+            return None
+        
+        count = frames.shape[0]
+        last_frame = f"frame_{count - 1:05d}.png"
+        
+        def upload(directory):
+            subfolder = f"{UPLOAD_SUBFOLDER}/{directory}" if UPLOAD_SUBFOLDER else directory
+            report = active_report()
+            
+            def upload_frame(index):
+                filename = f"frame_{index:05d}.png"
+                with reporting(report):
+                    started = time.perf_counter()
+                    img_bytes = encode_image_bytes(frames_to_uint8(frames[index]), "png", 1)
+                    note_io("encode_seconds", time.perf_counter() - started)
+                    files = {'image': (filename, img_bytes, 'image/png')}
+                    data = {'overwrite': 'true', 'type': 'input', 'subfolder': subfolder}
+                    url = f"http://{server_address}/upload/image"
+                    started = time.perf_counter()
+                    response = connection_manager.session(server_address).post(url, files=files, data=data, timeout=connection_manager.timeout("upload"))
+                    note_io("upload_bytes", len(img_bytes))
+                    note_io("upload_seconds", time.perf_counter() - started)
+                    if response.status_code != 200:
+                        note_error("upload", RemoteExecutionError(f"HTTP {response.status_code}", "http", response.status_code), file=f"{subfolder}/{filename}")
+                    return response.status_code == 200
+            
+            try:
+                # 最后一帧作为完成标记，必须在其他帧都上传成功之后再上传
+                if not all(run_in_pool(upload_frame, range(count - 1), UPLOAD_MAX_WORKERS)):
+                    return None
+                if not upload_frame(count - 1):
+                    return None
+            except Exception as e:
+                logger.warning("frame upload to %s failed: %s", self.mask_ip(server_address), e)
+                note_error("upload", e, file=subfolder)
+                return None
+            return subfolder
+        
+        return self._cached_upload(server_address, content_key, f"pond_{content_key[:32]}", upload, marker=last_frame)
+    
+    def resolve_input_patch(self, node, input_type, input_value, server_address, all_frames=False, options=None,
+                            content_hash=None):
+        class_type = node.get("class_type")
+        options = options or {}
         
-        node = workflow[node_id]
+        if input_type == "video":
+            codec = options.get("video_codec", "mp4_lossless")
+            
+            if class_type in FRAME_DIRECTORY_LOADER_FIELDS:
+                directory = self.upload_frame_sequence_to_remote(server_address, input_value, content_hash)
+                if directory:
+                    return {FRAME_DIRECTORY_LOADER_FIELDS[class_type]: directory}
+                return None
+            
+            if class_type in VIDEO_LOADER_FIELDS:
+                # 视频加载节点只能读取视频文件，选择图像序列时退回无损 MP4
+                if codec not in VIDEO_CODECS:
+                    codec = "mp4_lossless"
+                uploaded_filename = self.upload_video_to_remote(
+                    server_address, input_value, codec, options.get("video_fps", 24.0), content_hash
+                )
+                if uploaded_filename:
+                    return {VIDEO_LOADER_FIELDS[class_type]: uploaded_filename}
+                return None
         
         if input_type == "image" or input_type == "video":
-            if node.get("class_type") == "LoadImage":
-                uploaded_filename = self.upload_image_to_remote(server_address, input_value)
-                
+            if class_type == "LoadImage":
+                uploaded_filename = self.upload_image_to_remote(
+                    server_address, input_value, all_frames and input_type == "image", options, content_hash
+                )
                 if uploaded_filename:
-                    if "inputs" not in node:
-                        node["inputs"] = {}
-                    node["inputs"]["image"] = uploaded_filename
+                    return {"image": uploaded_filename}
         
         elif input_type == "text":
-            if "inputs" not in node:
-                node["inputs"] = {}
-            
+            inputs = node.get("inputs", {})
             text_fields = ["prompt", "text", "string", "value"]
             
-            found = False
             for field in text_fields:
-                if field in node["inputs"]:
-                    node["inputs"][field] = str(input_value)
-                    found = True
-                    break
+                if field in inputs:
+                    return {field: str(input_value)}
             
-            if not found:
-                node["inputs"]["prompt"] = str(input_value)
+            return {"prompt": str(input_value)}
         
         elif input_type == "audio":
-            if node.get("class_type") == "LoadAudio":
-                uploaded_filename = self.upload_audio_to_remote(server_address, input_value)
-                
+            if class_type == "LoadAudio":
+                uploaded_filename = self.upload_audio_to_remote(server_address, input_value, options, content_hash)
                 if uploaded_filename:
-                    if "inputs" not in node:
-                        node["inputs"] = {}
-                    node["inputs"]["audio"] = uploaded_filename
+                    return {"audio": uploaded_filename}
+        
+        return None
+    
+    def apply_input_patches(self, workflow, patches):
+        for node_id, patch in patches:
+            if not patch or node_id not in workflow:
+                continue
+            node = workflow[node_id]
+            # 节点可能与模板共享，替换成新字典而不是原地修改
+            workflow[node_id] = {**node, "inputs": {**node.get("inputs", {}), **patch}}
+        return workflow
+    
+    def modify_workflow_input(self, workflow, node_id, input_type, input_value, server_address):
+        if node_id not in workflow:
+            return workflow
+        
+        patch = self.resolve_input_patch(workflow[node_id], input_type, input_value, server_address)
+        return self.apply_input_patches(workflow, [(node_id, patch)])
+    
+    def plan_input_uploads(self, workflow, sorted_nodes, inputs, all_frames=False, options=None):
+        plan = []
+        type_counters = {"image": 0, "text": 0, "audio": 0, "video": 0}
+        
+        for node_id, input_type in sorted_nodes:
+            type_counters[input_type] += 1
+            input_key = f"{input_type}_{type_counters[input_type]}"
+            input_value = inputs.get(input_key)
+            
+            if input_value is None or node_id not in workflow:
+                continue
+            
+            plan.append({
+                "node_id": node_id,
+                "input_type": input_type,
+                "input_key": input_key,
+                "value": input_value,
+                "all_frames": all_frames,
+                "options": options,
+            })
+        return plan
+    
+    async def run_input_uploads_async(self, server_address, workflow, plan, max_workers=None, report=None):
+        if max_workers is None:
+            max_workers = UPLOAD_MAX_WORKERS
+        
+        def run_item(item):
+            start_time = time.perf_counter()
+            with reporting(report):
+                patch = self.resolve_input_patch(
+                    workflow[item["node_id"]], item["input_type"], item["value"], server_address,
+                    item.get("all_frames", False), item.get("options"), item.get("content_hash")
+                )
+            return {
+                "node_id": item["node_id"],
+                "input_key": item["input_key"],
+                "input_type": item["input_type"],
+                "patch": patch,
+                "ok": patch is not None,
+                "seconds": time.perf_counter() - start_time,
+            }
+        
+        # 文本输入无需网络请求，不占用线程池；结果保持计划顺序
+        upload_items = [item for item in plan if item["input_type"] != "text"]
+        uploaded = iter(await remote_engine.map(run_item, upload_items, max_workers))
+        results = [
+            run_item(item) if item["input_type"] == "text" else next(uploaded)
+            for item in plan
+        ]
+        
+        for result in results:
+            logger.debug(
+                "upload %s -> node %s: %s in %.3fs",
+                result["input_key"], result["node_id"], "ok" if result["ok"] else "failed", result["seconds"]
+            )
+        return results
+    
+    def run_input_uploads(self, server_address, workflow, plan, max_workers=None):
+        return remote_engine.run(self.run_input_uploads_async(server_address, workflow, plan, max_workers))
+    
+    def queue_prompt(self, server_address, workflow):
+        try:
+            url = f"http://{server_address}/prompt"
+            # 使用事件中心的 client_id，远程服务器才会把该任务的事件推送到共享 WebSocket
+            payload = {
+                "prompt": workflow,
+                "client_id": get_event_hub(server_address).client_id
+            }
+            
+            response = connection_manager.session(server_address).post(url, json=payload, timeout=connection_manager.timeout("queue"))
+            
+            if response.status_code == 200:
+                result = response.json()
+                return result.get("prompt_id")
+            else:
+                note_error("queue", RemoteExecutionError(self._prompt_error_message(response), "http", response.status_code))
+                return None
+                
+        except Exception as e:
+            note_error("queue", e)
+            return None
+    
+    def queue_prompt_reported(self, server_address, workflow, report=None):
+        with reporting(report):
+            return self.queue_prompt(server_address, workflow)
+    
+    def _prompt_error_message(self, response):
+        # 工作流校验失败时 ComfyUI 返回 400，正文带 error 和各节点的 node_errors
+        message = f"HTTP {response.status_code}"
+        try:
+            body = response.json()
+        except Exception:
+            return message
+        if not isinstance(body, dict):
+            return message
+        
+        error = body.get("error")
+        if isinstance(error, dict):
+            parts = [error.get("message"), error.get("details")]
+            message += ": " + " ".join(str(part) for part in parts if part)
+        elif error:
+            message += f": {error}"
+        
+        for node_id, node_error in (body.get("node_errors") or {}).items():
+            if not isinstance(node_error, dict):
+                continue
+            details = "; ".join(
+                " ".join(str(part) for part in (item.get("message"), item.get("details")) if part)
+                for item in node_error.get("errors", []) if isinstance(item, dict)
+            )
+            message += f" | {node_error.get('class_type') or node_id}: {details}"
+        return message
+    
+    async def wait_for_prompt_async(self, server_address, prompt_id, timeout=600, progress_listener=None,
+                                    cancel_check=local_interrupt_requested, refresh_first=False):
+        return await remote_engine.wait_prompt(
+            get_event_hub(server_address), prompt_id, timeout, progress_listener, cancel_check, refresh_first
+        )
+    
+    def cancel_remote_prompt(self, server_address, prompt_id):
+        session = connection_manager.session(server_address)
+        base_url = f"http://{server_address}"
+        try:
+            # 还在排队时从队列删除即可
+            session.post(f"{base_url}/queue", json={"delete": [prompt_id]}, timeout=connection_manager.timeout("queue"))
+            
+            response = session.get(f"{base_url}/queue", timeout=connection_manager.timeout("probe"))
+            running = response.json().get("queue_running", []) if response.status_code == 200 else []
+            # queue_running 的每一项为 [编号, prompt_id, prompt, extra_data, outputs]
+            if any(len(item) > 1 and item[1] == prompt_id for item in running):
+                # 新版 ComfyUI 只中断指定的 prompt_id；旧版忽略参数中断当前任务，上面已确认当前任务就是本任务
+                session.post(
+                    f"{base_url}/interrupt", json={"prompt_id": prompt_id}, timeout=connection_manager.timeout("queue")
+                )
+            return True
+        except Exception as e:
+            logger.warning("取消远程任务 %s 失败: %s", prompt_id, e)
+            return False
+    
+    def remote_prompt_state(self, server_address, prompt_id):
+        # 返回 queued、finished 或 failed，服务器不认识该任务（如远程已重启）时返回 None；连接失败直接抛出
+        session = connection_manager.session(server_address)
+        base_url = f"http://{server_address}"
+        # 先查队列再查历史，任务在两次请求之间执行完也不会漏掉
+        response = session.get(f"{base_url}/queue", timeout=connection_manager.timeout("probe"))
+        response.raise_for_status()
+        queue = response.json()
+        for item in queue.get("queue_running", []) + queue.get("queue_pending", []):
+            if len(item) > 1 and item[1] == prompt_id:
+                return "queued"
+        
+        response = session.get(f"{base_url}/history/{prompt_id}", timeout=connection_manager.timeout("probe"))
+        response.raise_for_status()
+        entry = response.json().get(prompt_id)
+        if not entry:
+            return None
+        return "failed" if (entry.get("status") or {}).get("status_str") == "error" else "finished"
+    
+    async def wait_for_completion_async(self, server_address, prompt_id, timeout=600, progress_listener=None):
+        watch = await self.wait_for_prompt_async(server_address, prompt_id, timeout, progress_listener)
+        return self.watch_outputs(watch)
+    
+    def watch_outputs(self, watch):
+        if watch.status is None:
+            return None
+        
+        if watch.status.get("status_str") == "error":
+            return None
+        
+        return watch.outputs
+    
+    def watch_error(self, watch, timeout):
+        if watch.status is None:
+            return RemoteExecutionError(f"执行超时（{timeout} 秒）", "timeout")
         
-        return workflow
+        error = watch.status.get("error") or {}
+        if not error:
+            return RemoteExecutionError("远程执行失败", "remote_execution")
+        node = error.get("node_type") or error.get("node_id") or ""
+        cause = ": ".join(str(part) for part in (error.get("exception_type"), error.get("exception_message")) if part)
+        return RemoteExecutionError(f"远程执行失败: {node} {cause}".strip(), "remote_execution")
     
-    def queue_prompt(self, server_address, workflow):
+    def wait_for_completion(self, server_address, prompt_id, timeout=600):
+        return remote_engine.run(self.wait_for_completion_async(server_address, prompt_id, timeout))
+    
+    def fetch_view(self, server_address, filename, subfolder="", folder_type="output", sink=None):
+        params = {
+            "filename": filename,
+            "subfolder": subfolder,
+            "type": folder_type
+        }
+        sink = sink if sink is not None else open_spool()
         try:
-            url = f"http://{server_address}/prompt"
-            payload = {
-                "prompt": workflow,
-                "client_id": self.client_id
-            }
+            stream_view(server_address, params, sink)
+        except Exception:
+            sink.close()
+            raise
+        return sink
+    
+    def download_output_file(self, server_address, filename, subfolder="", folder_type="output", video_options=None):
+        try:
+            file_ext = os.path.splitext(filename)[1].lower()
             
-            response = requests.post(url, json=payload, timeout=10)
+            if file_ext in VIDEO_EXTENSIONS:
+                return self.download_output_video(server_address, filename, subfolder, folder_type, video_options)
             
-            if response.status_code == 200:
-                result = response.json()
-                return result.get("prompt_id")
-            else:
-                return None
+            img_array = self.download_output_image(server_address, filename, subfolder, folder_type)
+            if img_array is None:
+                return None, None
+            return stack_uint8_images([img_array]), None
                 
         except Exception as e:
-            return None
+            note_error("decode", e, file=filename)
+            return None, None
     
-    def wait_for_completion(self, server_address, prompt_id, timeout=600):
-        import websocket
-        import threading
-        
-        result_data = {"status": None, "outputs": None}
-        ws_url = f"ws://{server_address}/ws?clientId={self.client_id}"
+    def download_output_image(self, server_address, filename, subfolder="", folder_type="output"):
+        try:
+            spool = self.fetch_view(server_address, filename, subfolder, folder_type)
+        except Exception as e:
+            note_error("download", e, file=filename)
+            return None
         
-        start_time = time.time()
+        try:
+            with spool:
+                img = Image.open(spool)
+                if img.mode != "RGB":
+                    img = img.convert("RGB")
+                return np.array(img)
+        except Exception as e:
+            note_error("decode", e, file=filename)
+            return None
+    
+    def download_output_video(self, server_address, filename, subfolder="", folder_type="output", video_options=None):
+        import tempfile
+        video_options = video_options or {}
+        file_ext = os.path.splitext(filename)[1].lower()
         
-        def on_message(ws, message):
+        # MP4 的索引可能在文件末尾，解码需要可随机读取的文件，视频直接下载到磁盘
+        with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as tmp_file:
+            tmp_path = tmp_file.name
             try:
-                if isinstance(message, bytes):
-                    return
-                
-                data = json.loads(message)
-                msg_type = data.get("type")
-                
-                if msg_type == "executing":
-                    node_id = data.get("data", {}).get("node")
-                    if node_id is None:
-                        result_data["status"] = {"status_str": "success"}
-                
-                elif msg_type == "executed":
-                    node_id = data.get("data", {}).get("node")
-                    output = data.get("data", {}).get("output", {})
-                    
-                    if result_data["outputs"] is None:
-                        result_data["outputs"] = {}
-                    
-                    result_data["outputs"][node_id] = output
-                
-                elif msg_type == "execution_error":
-                    error_data = data.get("data", {})
-                    result_data["status"] = {"status_str": "error", "error": error_data}
-                    
+                self.fetch_view(server_address, filename, subfolder, folder_type, sink=tmp_file)
+                downloaded = True
             except Exception as e:
+                note_error("download", e, file=filename)
+                downloaded = False
+        
+        try:
+            if not downloaded:
+                return None, None
+            
+            return decode_media_file(
+                tmp_path,
+                video_options.get("frame_stride", 1),
+                video_options.get("max_frames", 0),
+                video_options.get("max_side", 0),
+            )
+        except Exception as e:
+            note_error("decode", e, file=filename)
+            return None, None
+        finally:
+            try:
+                os.unlink(tmp_path)
+            except:
                 pass
+    
+    def download_output_audio(self, server_address, filename, subfolder="", folder_type="output"):
+        file_ext = os.path.splitext(filename)[1].lower()
+        try:
+            with self.fetch_view(server_address, filename, subfolder, folder_type) as spool:
+                data = spool.read()
+        except Exception as e:
+            note_error("download", e, file=filename)
+            return None
         
-        def on_error(ws, error):
-            pass
+        try:
+            return decode_audio_bytes(data, file_ext)
+        except Exception as e:
+            note_error("decode", e, file=filename)
+            return None
+    
+    def _download_job(self, server_address, job, options=None, report=None):
+        if report is None:
+            return self._fetch_output(server_address, job, options)
         
-        def on_close(ws, close_status_code, close_msg):
-            pass
+        # stream_view 把本线程的下载耗时累加到 _run_context，其余时间算作解码
+        _run_context.download_seconds = 0.0
+        started = time.perf_counter()
+        with reporting(report):
+            result = self._fetch_output(server_address, job, options)
+        elapsed = time.perf_counter() - started
+        download_seconds = _run_context.download_seconds
+        decode_seconds = max(0.0, elapsed - download_seconds)
+        report.add_io("decode_seconds", decode_seconds)
+        report.downloads.append({
+            "kind": job[0],
+            "filename": job[1].get("filename", ""),
+            "download": round(download_seconds, 4),
+            "decode": round(decode_seconds, 4),
+            "ok": result is not None and not (isinstance(result, tuple) and result[0] is None),
+        })
+        return result
+    
+    def _fetch_output(self, server_address, job, options=None):
+        kind, file_info = job
+        filename = file_info.get("filename", "")
+        subfolder = file_info.get("subfolder", "")
+        folder_type = file_info.get("type", "output")
         
-        def on_open(ws):
-            pass
+        if kind == "audio":
+            return self.download_output_audio(server_address, filename, subfolder, folder_type)
+        if kind == "image":
+            # 图像保持 uint8，全部下载完后再一次性拼成批次
+            return self.download_output_image(server_address, filename, subfolder, folder_type)
         
-        ws = websocket.WebSocketApp(
-            ws_url,
-            on_message=on_message,
-            on_error=on_error,
-            on_close=on_close,
-            on_open=on_open
+        options = options or {}
+        video_options = {
+            "frame_stride": options.get("output_frame_stride", 1),
+            "max_frames": options.get("output_max_frames", 0),
+            "max_side": options.get("output_max_side", 0),
+        }
+        return self.download_output_file(server_address, filename, subfolder, folder_type, video_options)
+    
+    async def download_outputs_async(self, server_address, jobs, max_workers=None, options=None, report=None):
+        if max_workers is None:
+            max_workers = DOWNLOAD_MAX_WORKERS
+        return await remote_engine.map(
+            lambda job: self._download_job(server_address, job, options, report), jobs, max_workers
         )
+    
+    def download_outputs(self, server_address, jobs, max_workers=None, options=None):
+        return remote_engine.run(self.download_outputs_async(server_address, jobs, max_workers, options))
+    
+    def execute_remote(self, remote_ip, remote_port, workflow_file, selected_nodes, saved_state="{}", **kwargs):
+        return remote_engine.run(
+            self.execute_remote_async(remote_ip, remote_port, workflow_file, selected_nodes, saved_state, **kwargs)
+        )
+    
+    async def rank_servers_async(self, servers):
+        for server, _ in servers:
+            server_pool.monitor(server)
+        stale = [server for server, _ in servers if server_pool.needs_probe(server)]
+        if stale:
+            await asyncio.gather(*(remote_engine.call(server_pool.probe, server) for server in stale))
+        return server_pool.rank(servers)
+    
+    async def submit_to_server_async(self, server_address, workflow, upload_plan, report=None, queue_on_upload_failure=True):
+        hub = get_event_hub(server_address)
         
-        ws_thread = threading.Thread(target=ws.run_forever)
-        ws_thread.daemon = True
-        ws_thread.start()
-        
-        elapsed = 0
-        while elapsed < timeout:
-            if result_data["status"] is not None:
-                break
-            time.sleep(0.5)
-            elapsed = time.time() - start_time
-        
-        ws.close()
+        # 上传输入的同时建立事件连接，提交前必须已连上才能收到该任务的全部事件
+        async def connect():
+            started = time.perf_counter()
+            started_at = time.time()
+            await remote_engine.call(hub.ensure_connected, connection_manager.timeouts["connect"])
+            if report is not None:
+                report.add("connect", time.perf_counter() - started, started_at)
         
-        if result_data["status"] is None:
-            return None
+        errors_before = len(report.errors) if report is not None else 0
+        upload_timer = time.perf_counter()
+        upload_started_at = time.time()
+        upload_results, _ = await asyncio.gather(
+            self.run_input_uploads_async(server_address, workflow, upload_plan, report=report),
+            connect(),
+        )
+        self.last_upload_report = [
+            {key: result[key] for key in ("input_key", "node_id", "input_type", "ok", "seconds")}
+            for result in upload_results
+        ]
+        upload_ok = all(result["ok"] for result in upload_results)
+        workflow = self.apply_input_patches(
+            workflow, [(result["node_id"], result["patch"]) for result in upload_results]
+        )
         
-        if result_data["status"].get("status_str") == "error":
-            return None
+        queue_timer = time.perf_counter()
+        # 还能切换到下一台服务器时不提交：输入不完整的任务没有人等待，只会白白占用远程 GPU
+        # 上传失败的原因在本地（输入无效、编码失败等）时，最后一台服务器也不提交
+        client_failure = report is not None and any(
+            not is_server_fault(error) for error in report.errors[errors_before:] if error["phase"] == "upload"
+        )
+        should_queue = upload_ok or (queue_on_upload_failure and not client_failure)
+        prompt_id = await remote_engine.call(self.queue_prompt_reported, server_address, workflow, report) if should_queue else None
         
-        return result_data["outputs"]
+        if report is not None:
+            report.add("upload", queue_timer - upload_timer, upload_started_at)
+            if should_queue:
+                report.add("queue", time.perf_counter() - queue_timer, upload_started_at + (queue_timer - upload_timer))
+            report.uploads = [
+                {"input": item["input_key"], "node": item["node_id"], "ok": item["ok"], "seconds": round(item["seconds"], 4)}
+                for item in self.last_upload_report
+            ]
+        return prompt_id, upload_ok, workflow
     
-    def download_output_file(self, server_address, filename, subfolder="", folder_type="output"):
+    def error_outputs(self, message):
+        error_img = torch.zeros((1, 64, 64, 3))
+        return (error_img, message, self.create_empty_audio(), error_img)
+    
+    def prepare_workflow(self, workflow_file, selected_nodes):
         try:
-            url = f"http://{server_address}/view"
-            params = {
-                "filename": filename,
-                "subfolder": subfolder,
-                "type": folder_type
-            }
-            response = requests.get(url, params=params, timeout=30)
-            
-            if response.status_code == 200:
-                file_ext = os.path.splitext(filename)[1].lower()
-                
-                if file_ext in ['.mp4', '.avi', '.mov', '.webm', '.mkv', '.gif']:
-                    import tempfile
-                    with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as tmp_file:
-                        tmp_file.write(response.content)
-                        tmp_path = tmp_file.name
-                    
-                    try:
-                        import cv2
-                        cap = cv2.VideoCapture(tmp_path)
-                        
-                        frames = []
-                        while True:
-                            ret, frame = cap.read()
-                            if not ret:
-                                break
-                            frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                            frame_tensor = torch.from_numpy(frame_rgb).float() / 255.0
-                            frames.append(frame_tensor)
-                        
-                        cap.release()
-                        
-                        if frames:
-                            video_tensor = torch.stack(frames, dim=0)
-                            
-                            audio_data = None
-                            
-                            try:
-                                import subprocess
-                                
-                                audio_tmp_path = tmp_path.replace(file_ext, '.wav')
-                                
-                                cmd = [
-                                    'ffmpeg',
-                                    '-i', tmp_path,
-                                    '-vn',
-                                    '-acodec', 'pcm_s16le',
-                                    '-ar', '44100',
-                                    '-ac', '2',
-                                    '-y',
-                                    audio_tmp_path
-                                ]
-                                
-                                result = subprocess.run(
-                                    cmd,
-                                    stdout=subprocess.PIPE,
-                                    stderr=subprocess.PIPE,
-                                    timeout=60
-                                )
-                                
-                                if result.returncode == 0 and os.path.exists(audio_tmp_path):
-                                    import torchaudio
-                                    waveform, sample_rate = torchaudio.load(audio_tmp_path)
-                                    
-                                    if waveform.dim() == 2:
-                                        waveform = waveform.unsqueeze(0)
-                                    
-                                    audio_data = {
-                                        "waveform": waveform,
-                                        "sample_rate": sample_rate
-                                    }
-                                    
-                                    try:
-                                        os.unlink(audio_tmp_path)
-                                    except:
-                                        pass
-                                    
-                            except:
-                                try:
-                                    import torchaudio
-                                    waveform, sample_rate = torchaudio.load(tmp_path)
-                                    
-                                    if waveform.dim() == 2:
-                                        waveform = waveform.unsqueeze(0)
-                                    
-                                    audio_data = {
-                                        "waveform": waveform,
-                                        "sample_rate": sample_rate
-                                    }
-                                except:
-                                    pass
-                            
-                            try:
-                                os.unlink(tmp_path)
-                            except:
-                                pass
-                            
-                            return video_tensor, audio_data
-                        else:
-                            try:
-                                os.unlink(tmp_path)
-                            except:
-                                pass
-                            return None, None
-                            
-                    except Exception as video_error:
-                        try:
-                            os.unlink(tmp_path)
-                        except:
-                            pass
-                        return None, None
-                
-                else:
-                    img = Image.open(io.BytesIO(response.content))
-                    img = img.convert("RGB")
-                    img_array = np.array(img).astype(np.float32) / 255.0
-                    img_tensor = torch.from_numpy(img_array).unsqueeze(0)
-                    return img_tensor, None
-            else:
-                return None, None
-                
+            template = workflow_templates.get(workflow_file)
         except Exception as e:
-            return None, None
+            raise RemoteExecutionError(f"工作流加载失败: {e}", "invalid_workflow")
+        
+        if not template.is_api_format:
+            raise RemoteExecutionError("请使用API格式的工作流文件", "invalid_workflow")
+        
+        try:
+            selected_map = json.loads(selected_nodes)
+        except Exception:
+            raise RemoteExecutionError("选中节点数据格式错误", "invalid_workflow")
+        
+        if not selected_map:
+            raise RemoteExecutionError("未选中任何节点", "invalid_workflow")
+        
+        sorted_nodes = sorted(selected_map.items(), key=lambda x: int(x[0]))
+        
+        unknown = [node_id for node_id, _ in sorted_nodes if node_id not in template.input_nodes]
+        if unknown:
+            logger.warning("选中的节点不是已知的输入节点: %s", ", ".join(unknown))
+        
+        return template.instantiate(), sorted_nodes
     
-    def download_output_audio(self, server_address, filename, subfolder="", folder_type="output"):
+    def build_options(self, video_codec="mp4_lossless", video_fps=24.0, image_format="auto", image_compress_level=6,
+                      output_size_policy="resize", use_result_cache=False,
+                      output_frame_stride=1, output_max_frames=0, output_max_side=0, audio_format="wav"):
+        return {
+            "video_codec": video_codec,
+            "video_fps": video_fps,
+            "image_format": image_format,
+            "image_compress_level": image_compress_level,
+            "output_size_policy": output_size_policy,
+            "use_result_cache": use_result_cache,
+            "output_frame_stride": output_frame_stride,
+            "output_max_frames": output_max_frames,
+            "output_max_side": output_max_side,
+            "audio_format": audio_format,
+        }
+    
+    async def execute_remote_async(self, remote_ip, remote_port, workflow_file, selected_nodes, saved_state="{}",
+                                   video_codec="mp4_lossless", video_fps=24.0,
+                                   batch_mode="off", batch_chunk_size=1, max_parallel_jobs=4,
+                                   image_format="auto", image_compress_level=6, output_size_policy="resize",
+                                   use_result_cache=False,
+                                   output_frame_stride=1, output_max_frames=0, output_max_side=0,
+                                   audio_format="wav", **kwargs):
+        report = RunReport()
+        self.last_run_report = report
+        
         try:
-            url = f"http://{server_address}/view"
-            params = {
-                "filename": filename,
-                "subfolder": subfolder,
-                "type": folder_type
-            }
-            response = requests.get(url, params=params, timeout=30)
+            servers = parse_server_list(remote_ip, remote_port)
+            workflow, sorted_nodes = self.prepare_workflow(workflow_file, selected_nodes)
+            options = self.build_options(
+                video_codec, video_fps, image_format, image_compress_level, output_size_policy,
+                use_result_cache, output_frame_stride, output_max_frames, output_max_side, audio_format
+            )
+            progress_node = kwargs.get("unique_id")
             
-            if response.status_code == 200:
-                import tempfile
-                file_ext = os.path.splitext(filename)[1].lower()
-                
-                with tempfile.NamedTemporaryFile(suffix=file_ext, delete=False) as tmp_file:
-                    tmp_file.write(response.content)
-                    tmp_path = tmp_file.name
-                
-                try:
-                    import torchaudio
-                    waveform, sample_rate = torchaudio.load(tmp_path)
-                    
-                    if waveform.dim() == 2:
-                        waveform = waveform.unsqueeze(0)
-                    
-                    audio_data = {
-                        "waveform": waveform,
-                        "sample_rate": sample_rate
-                    }
-                    
-                    try:
-                        os.unlink(tmp_path)
-                    except:
-                        pass
-                    
-                    return audio_data
-                except Exception as load_error:
-                    try:
-                        os.unlink(tmp_path)
-                    except:
-                        pass
-                    return None
+            if batch_mode == "split":
+                outputs = await self.run_batch_async(
+                    servers, workflow, sorted_nodes, kwargs, batch_chunk_size, max_parallel_jobs, options,
+                    progress_node=progress_node, report=report
+                )
             else:
-                return None
-                
-        except Exception as e:
-            return None
+                outputs = await self.run_job_async(
+                    servers, workflow, sorted_nodes, kwargs, options=options,
+                    progress_node=progress_node, report=report
+                )
+        except RemoteExecutionError as e:
+            report.fail(e)
+            outputs = self.error_outputs(str(e))
+        except BaseException as e:
+            report.fail(e)
+            raise
+        finally:
+            await self.finish_report_async(report)
+        
+        return (*outputs, report.to_json())
     
-    def execute_remote(self, remote_ip, remote_port, workflow_file, selected_nodes, saved_state="{}", **kwargs):
-        server_address = f"{remote_ip}:{remote_port}"
+    async def finish_report_async(self, report):
+        report.finish()
+        logger.info("远程执行耗时: %s", report.summary())
+        if _metrics_hooks:
+            await remote_engine.call(emit_run_report, report)
+    
+    async def run_job_async(self, servers, workflow, sorted_nodes, inputs, all_frames=False, options=None,
+                            progress_node=None, report=None):
+        job = await self.submit_job_async(servers, workflow, sorted_nodes, inputs, all_frames, options, report)
+        return await self.fetch_job_async(job, progress_node)
+    
+    async def submit_job_async(self, servers, workflow, sorted_nodes, inputs, all_frames=False, options=None, report=None):
+        options = options or {}
+        report = report if report is not None else RunReport()
+        upload_plan = self.plan_input_uploads(workflow, sorted_nodes, inputs, all_frames, options)
         
-        if not self.test_remote_connection(server_address):
-            error_img = torch.zeros((1, 64, 64, 3))
-            return (error_img, "无法连接到远程服务器", self.create_empty_audio(), error_img)
+        cache_key = None
+        job_key = None
+        input_hashes = []
+        if options.get("use_result_cache") or job_store.enabled:
+            done = report.timer()
+            input_hashes = await remote_engine.call(plan_input_hashes, upload_plan)
+            # 上传时直接由这些哈希派生缓存键，每个输入只完整哈希一次
+            for item, value_hash in zip(upload_plan, input_hashes):
+                item["content_hash"] = value_hash
+            job_key = await remote_engine.call(result_cache_key, workflow, upload_plan, options, input_hashes)
+            done("hash")
         
-        workflow = self.load_workflow(workflow_file)
-        if workflow is None:
-            error_img = torch.zeros((1, 64, 64, 3))
-            return (error_img, "工作流加载失败", self.create_empty_audio(), error_img)
+        if options.get("use_result_cache"):
+            cache_key = job_key
+            done = report.timer()
+            cached = await remote_engine.call(result_cache.get, cache_key)
+            done("cache")
+            if cached is not None:
+                report.cache_hit = True
+                return RemoteJob(workflow=workflow, options=options, report=report, cached_outputs=cached)
         
-        is_api_format = False
+        done = report.timer()
+        candidates = await self.rank_servers_async(servers) if servers else []
+        done("probe")
         
-        if isinstance(workflow, dict):
-            first_key = next(iter(workflow.keys()), None)
-            if first_key and first_key.isdigit():
-                is_api_format = True
+        if not candidates or not any(server_pool.snapshot(server)["healthy"] for server in candidates):
+            raise RemoteExecutionError("无法连接到远程服务器", "unreachable")
         
-        if not is_api_format:
-            error_img = torch.zeros((1, 64, 64, 3))
-            return (error_img, "请使用API格式的工作流文件", self.create_empty_audio(), error_img)
+        candidates = await self.capable_servers_async(candidates, workflow)
         
-        try:
-            selected_map = json.loads(selected_nodes)
-        except:
-            error_img = torch.zeros((1, 64, 64, 3))
-            return (error_img, "选中节点数据格式错误", self.create_empty_audio(), error_img)
+        if job_key is not None and job_store.enabled:
+            done = report.timer()
+            job = await self.reattach_job_async(job_key, candidates, workflow, options, cache_key, report)
+            done("reattach")
+            if job is not None:
+                return job
         
-        if not selected_map:
-            error_img = torch.zeros((1, 64, 64, 3))
-            return (error_img, "未选中任何节点", self.create_empty_audio(), error_img)
+        cause = None
+        for index, candidate in enumerate(candidates):
+            if local_interrupt_requested():
+                raise_interrupted()
+            
+            is_last = index == len(candidates) - 1
+            errors_before = len(report.errors)
+            server_pool.acquire(candidate)
+            try:
+                prompt_id, upload_ok, patched = await self.submit_to_server_async(
+                    candidate, workflow, upload_plan, report, queue_on_upload_failure=is_last
+                )
+            except Exception as e:
+                logger.debug("submit to %s failed: %s", self.mask_ip(candidate), e)
+                report.add_error("submit", e, server=self.mask_ip(candidate))
+                prompt_id, upload_ok = None, False
+            
+            # 上传或提交因服务器的问题失败时切换到下一台服务器；只剩最后一台时保留原来的行为
+            if prompt_id is not None and (upload_ok or is_last):
+                server_pool.mark_success(candidate)
+                report.server = self.mask_ip(candidate)
+                report.prompt_id = prompt_id
+                if job_key is not None:
+                    await remote_engine.call(job_store.record, job_key, candidate, prompt_id, input_hashes)
+                return RemoteJob(candidate, prompt_id, patched, options, cache_key, report, job_key=job_key)
+            
+            server_pool.release(candidate)
+            attempt_errors = report.errors[errors_before:]
+            if attempt_errors and not any(is_server_fault(error) for error in attempt_errors):
+                # 本地原因导致的失败：换服务器也没用，不切换，也不让服务器进入冷却
+                error = attempt_errors[-1]
+                raise RemoteExecutionError(f"提交工作流失败: {error['message']}", error["kind"], error.get("status"))
+            server_pool.mark_failure(candidate)
+            # 最终错误带上最后一台服务器失败的原因
+            cause = next((error["message"] for error in reversed(attempt_errors)), cause)
         
-        sorted_nodes = sorted(selected_map.items(), key=lambda x: int(x[0]))
+        raise RemoteExecutionError(f"提交工作流失败: {cause}" if cause else "提交工作流失败", "submit")
+    
+    async def reattach_job_async(self, job_key, candidates, workflow, options, cache_key, report):
+        # 同样的工作流和输入之前已提交过（例如 ComfyUI 重启前）：仍在远程排队/执行或已完成的任务直接接回，
+        # 不再上传和提交
+        for server_address, prompt_id in await remote_engine.call(job_store.find, job_key, candidates):
+            try:
+                state = await remote_engine.call(self.remote_prompt_state, server_address, prompt_id)
+            except Exception as e:
+                logger.debug("reattach check on %s failed: %s", self.mask_ip(server_address), e)
+                continue
+            
+            if state in ("queued", "finished"):
+                server_pool.acquire(server_address)
+                report.server = self.mask_ip(server_address)
+                report.prompt_id = prompt_id
+                report.reattached = True
+                logger.info("接回远程任务 %s（%s）", prompt_id, report.server)
+                # 输出节点只看节点类型，用未替换输入的工作流即可
+                return RemoteJob(server_address, prompt_id, workflow, options, cache_key, report,
+                                 job_key=job_key, reattached=True)
+            await remote_engine.call(job_store.update, prompt_id, state or "lost")
+        return None
+    
+    async def capable_servers_async(self, candidates, workflow):
+        # 上传前排除缺少工作流所需节点的服务器
+        template = getattr(workflow, "template", None) or WorkflowTemplate(dict(workflow))
+        missing = await asyncio.gather(
+            *(remote_engine.call(server_pool.missing_node_classes, server, template.class_types) for server in candidates)
+        )
+        capable = [server for server, classes in zip(candidates, missing) if not classes]
+        if not capable:
+            raise RemoteExecutionError(f"远程服务器缺少节点: {', '.join(missing[0])}", "missing_nodes")
+        for server, classes in zip(candidates, missing):
+            if classes:
+                logger.warning("服务器 %s 缺少节点 %s，已跳过", self.mask_ip(server), ", ".join(classes))
+        return capable
+    
+    async def fetch_job_async(self, job, progress_node=None, timeout=600):
+        if job.cached_outputs is not None:
+            return job.cached_outputs
         
-        type_counters = {"image": 0, "text": 0, "audio": 0, "video": 0}
+        report = job.report
+        options = job.options
+        workflow = job.workflow
+        progress = RemoteProgressForwarder(progress_node, len(workflow)) if progress_node is not None else None
         
-        for node_id, input_type in sorted_nodes:
-            type_counters[input_type] += 1
-            counter = type_counters[input_type]
+        try:
+            watch = await self.wait_for_prompt_async(
+                job.server_address, job.prompt_id, timeout, progress, refresh_first=job.reattached
+            )
+            report.add_watch(watch, workflow, job.submitted_at)
             
-            input_key = f"{input_type}_{counter}"
-            input_value = kwargs.get(input_key)
+            if watch.cancelled:
+                await remote_engine.call(self.cancel_remote_prompt, job.server_address, job.prompt_id)
+                await self.update_job_store_async(job, "cancelled")
+                raise_interrupted()
             
-            if input_value is None:
-                continue
+            all_outputs = self.watch_outputs(watch)
+            
+            if all_outputs is None:
+                # 超时的任务保持 submitted，之后重新执行时还能接回
+                if watch.status is not None:
+                    await self.update_job_store_async(job, "failed")
+                raise self.watch_error(watch, timeout)
             
-            workflow = self.modify_workflow_input(workflow, node_id, input_type, input_value, server_address)
+            await self.update_job_store_async(job, "finished")
+            done = report.timer()
+            download_jobs, output_texts = self.select_output_jobs(workflow, all_outputs)
+            download_results = await self.download_outputs_async(
+                job.server_address, download_jobs, options=options, report=report
+            )
+            done("outputs")
+        finally:
+            job.release()
         
-        prompt_id = self.queue_prompt(server_address, workflow)
+        done = report.timer()
+        outputs = self.assemble_outputs(download_jobs, download_results, output_texts, options)
+        done("assemble")
+        await self.update_job_store_async(job, "delivered")
         
-        if prompt_id is None:
-            error_img = torch.zeros((1, 64, 64, 3))
-            return (error_img, "提交工作流失败", self.create_empty_audio(), error_img)
+        # 只缓存所有输出都下载成功的结果
+        if job.cache_key and self.outputs_complete(download_jobs, download_results):
+            try:
+                await remote_engine.call(result_cache.put, job.cache_key, outputs)
+            except Exception as e:
+                logger.warning("结果缓存写入失败: %s", e)
         
-        all_outputs = self.wait_for_completion(server_address, prompt_id)
+        return outputs
+    
+    async def update_job_store_async(self, job, status):
+        if job.job_key is not None:
+            await remote_engine.call(job_store.update, job.prompt_id, status)
+    
+    def outputs_complete(self, download_jobs, download_results):
+        for (kind, _), result in zip(download_jobs, download_results):
+            if result is None or (kind == "video" and result[0] is None):
+                return False
+        return True
+    
+    def split_batch_inputs(self, inputs, chunk_size):
+        image_keys = [
+            key for key, value in inputs.items()
+            if key.startswith("image_") and isinstance(value, torch.Tensor) and value.dim() == 4
+        ]
+        batch_size = max((inputs[key].shape[0] for key in image_keys), default=0)
+        if batch_size <= 1:
+            return [inputs]
         
-        if all_outputs is None:
-            error_img = torch.zeros((1, 64, 64, 3))
-            return (error_img, "执行失败或超时", self.create_empty_audio(), error_img)
+        for key in image_keys:
+            if inputs[key].shape[0] not in (1, batch_size):
+                raise RemoteExecutionError("批量模式下各图像输入的批次大小必须一致", "invalid_input")
         
-        output_images = []
+        # 批次为 1 的图像输入在每个子任务中共用
+        split_keys = [key for key in image_keys if inputs[key].shape[0] == batch_size]
+        chunk_size = max(1, int(chunk_size))
+        job_inputs = []
+        for start in range(0, batch_size, chunk_size):
+            job = dict(inputs)
+            for key in split_keys:
+                job[key] = inputs[key][start:start + chunk_size]
+            job_inputs.append(job)
+        return job_inputs
+    
+    async def run_batch_async(self, servers, workflow, sorted_nodes, inputs, chunk_size, max_parallel_jobs, options=None,
+                              progress_node=None, report=None):
+        job_inputs = self.split_batch_inputs(inputs, chunk_size)
+        if len(job_inputs) == 1:
+            return await self.run_job_async(
+                servers, workflow, sorted_nodes, inputs, options=options, progress_node=progress_node, report=report
+            )
+        
+        semaphore = asyncio.Semaphore(max(1, int(max_parallel_jobs)))
+        # 多个子任务并行时只显示已完成的子任务数
+        progress = RemoteProgressForwarder(progress_node, len(job_inputs)) if progress_node is not None else None
+        finished = [0]
+        
+        async def run_chunk(index, job):
+            child = RunReport(f"batch {index + 1}/{len(job_inputs)}")
+            if report is not None:
+                report.children.append(child)
+            async with semaphore:
+                # 每个子任务修改自己的工作流副本，避免并发提交时互相覆盖输入
+                try:
+                    return await self.run_job_async(
+                        servers, WorkflowInstance(workflow, getattr(workflow, "template", None)), sorted_nodes, job,
+                        all_frames=True, options=options, report=child
+                    )
+                except BaseException as e:
+                    child.fail(e)
+                    raise
+                finally:
+                    child.finish()
+                    finished[0] += 1
+                    if progress is not None:
+                        progress.update(finished[0], len(job_inputs))
+        
+        results = await asyncio.gather(*(run_chunk(index, job) for index, job in enumerate(job_inputs)), return_exceptions=True)
+        self.check_batch_results(results)
+        return self.merge_batch_outputs(results, options)
+    
+    def check_batch_results(self, results):
+        interrupt_class = interrupt_exception_class()
+        for result in results:
+            if interrupt_class is not None and isinstance(result, interrupt_class):
+                raise result
+        
+        for index, result in enumerate(results):
+            if isinstance(result, BaseException):
+                message = str(result) if isinstance(result, RemoteExecutionError) else "执行失败"
+                raise RemoteExecutionError(f"批量任务 {index + 1}/{len(results)} 失败: {message}", classify_error(result))
+    
+    def merge_batch_outputs(self, results, options=None):
+        options = options or {}
+        final_image = concat_image_batches(
+            [result[0] for result in results], options.get("output_size_policy", "resize")
+        )
+        texts = [result[1] for result in results]
+        final_text = texts[0] if len(set(texts)) == 1 else "\n".join(texts)
+        final_audio = results[-1][2]
+        final_video = results[-1][3]
+        return (final_image, final_text, final_audio, final_video)
+    
+    def select_output_jobs(self, workflow, all_outputs):
+        download_jobs = []
         output_texts = []
-        output_audios = []
-        output_videos = []
         
-        if all_outputs:
-            save_image_nodes = []
-            preview_image_nodes = []
-            text_nodes = []
-            video_nodes = []
-            audio_nodes = []
+        if not all_outputs:
+            return download_jobs, output_texts
+        
+        save_image_nodes = []
+        preview_image_nodes = []
+        text_nodes = []
+        video_nodes = []
+        audio_nodes = []
+        
+        # 输出节点索引在模板里预先算好，直接查表
+        template = getattr(workflow, "template", None)
+        
+        for node_id, node_output in all_outputs.items():
+            if not node_output:
+                continue
             
-            for node_id, node_output in all_outputs.items():
-                if not node_output:
-                    continue
-                
+            if template is not None:
+                node_class = template.output_nodes.get(node_id, "")
+            else:
                 node_class = workflow.get(node_id, {}).get("class_type", "")
-                
+            
+            if "images" in node_output:
+                if node_class == "SaveImage":
+                    save_image_nodes.append(node_id)
+                elif node_class == "PreviewImage":
+                    preview_image_nodes.append(node_id)
+            
+            if "text" in node_output or "string" in node_output:
+                text_nodes.append(node_id)
+            
+            if "gifs" in node_output:
+                video_nodes.append(node_id)
+            
+            if "audio" in node_output or "audios" in node_output:
+                audio_nodes.append(node_id)
+        
+        final_image_node = None
+        if save_image_nodes:
+            final_image_node = max(save_image_nodes, key=lambda x: int(x))
+        elif preview_image_nodes:
+            final_image_node = max(preview_image_nodes, key=lambda x: int(x))
+        else:
+            for node_id, node_output in all_outputs.items():
+                if node_output and "images" in node_output:
+                    final_image_node = node_id
+        
+        final_text_node = None
+        if text_nodes:
+            final_text_node = max(text_nodes, key=lambda x: int(x))
+        
+        final_video_node = None
+        if video_nodes:
+            final_video_node = max(video_nodes, key=lambda x: int(x))
+        
+        final_audio_node = None
+        if audio_nodes:
+            final_audio_node = max(audio_nodes, key=lambda x: int(x))
+        
+        if final_image_node and final_image_node in all_outputs:
+            node_output = all_outputs[final_image_node]
+            if node_output:
                 if "images" in node_output:
-                    if node_class == "SaveImage":
-                        save_image_nodes.append(node_id)
-                    elif node_class == "PreviewImage":
-                        preview_image_nodes.append(node_id)
-                
-                if "text" in node_output or "string" in node_output:
-                    text_nodes.append(node_id)
+                    for img_info in node_output["images"]:
+                        download_jobs.append(("image", img_info))
+        
+        if final_text_node and final_text_node in all_outputs:
+            node_output = all_outputs[final_text_node]
+            if node_output:
+                if "text" in node_output:
+                    if isinstance(node_output["text"], list):
+                        for text_item in node_output["text"]:
+                            output_texts.append(str(text_item))
+                    else:
+                        output_texts.append(str(node_output["text"]))
                 
+                if "string" in node_output:
+                    if isinstance(node_output["string"], list):
+                        for string_item in node_output["string"]:
+                            output_texts.append(str(string_item))
+                    else:
+                        output_texts.append(str(node_output["string"]))
+        
+        if final_video_node and final_video_node in all_outputs:
+            node_output = all_outputs[final_video_node]
+            if node_output:
                 if "gifs" in node_output:
-                    video_nodes.append(node_id)
+                    for gif_info in node_output["gifs"]:
+                        download_jobs.append(("video", gif_info))
+        
+        if final_audio_node and final_audio_node in all_outputs:
+            node_output = all_outputs[final_audio_node]
+            if node_output:
+                if "audio" in node_output:
+                    audio_list = node_output["audio"]
+                elif "audios" in node_output:
+                    audio_list = node_output["audios"]
+                else:
+                    audio_list = []
                 
-                if "audio" in node_output or "audios" in node_output:
-                    audio_nodes.append(node_id)
-            
-            final_image_node = None
-            if save_image_nodes:
-                final_image_node = max(save_image_nodes, key=lambda x: int(x))
-            elif preview_image_nodes:
-                final_image_node = max(preview_image_nodes, key=lambda x: int(x))
-            else:
-                for node_id, node_output in all_outputs.items():
-                    if node_output and "images" in node_output:
-                        final_image_node = node_id
-            
-            final_text_node = None
-            if text_nodes:
-                final_text_node = max(text_nodes, key=lambda x: int(x))
-            
-            final_video_node = None
-            if video_nodes:
-                final_video_node = max(video_nodes, key=lambda x: int(x))
-            
-            final_audio_node = None
-            if audio_nodes:
-                final_audio_node = max(audio_nodes, key=lambda x: int(x))
-            
-            if final_image_node and final_image_node in all_outputs:
-                node_output = all_outputs[final_image_node]
-                if node_output:
-                    if "images" in node_output:
-                        for img_info in node_output["images"]:
-                            img_tensor, _ = self.download_output_file(
-                                server_address,
-                                img_info["filename"],
-                                img_info.get("subfolder", ""),
-                                img_info.get("type", "output")
-                            )
-                            if img_tensor is not None:
-                                output_images.append(img_tensor)
-            
-            if final_text_node and final_text_node in all_outputs:
-                node_output = all_outputs[final_text_node]
-                if node_output:
-                    if "text" in node_output:
-                        if isinstance(node_output["text"], list):
-                            for text_item in node_output["text"]:
-                                output_texts.append(str(text_item))
-                        else:
-                            output_texts.append(str(node_output["text"]))
-                    
-                    if "string" in node_output:
-                        if isinstance(node_output["string"], list):
-                            for string_item in node_output["string"]:
-                                output_texts.append(str(string_item))
-                        else:
-                            output_texts.append(str(node_output["string"]))
-            
-            if final_video_node and final_video_node in all_outputs:
-                node_output = all_outputs[final_video_node]
-                if node_output:
-                    if "gifs" in node_output:
-                        for gif_info in node_output["gifs"]:
-                            video_filename = gif_info.get("filename", "")
-                            
-                            video_tensor, video_audio = self.download_output_file(
-                                server_address,
-                                video_filename,
-                                gif_info.get("subfolder", ""),
-                                gif_info.get("type", "output")
-                            )
-                            
-                            if video_tensor is not None:
-                                output_videos.append(video_tensor)
-                                
-                                if video_audio is not None:
-                                    output_audios.append(video_audio)
-            
-            if final_audio_node and final_audio_node in all_outputs:
-                node_output = all_outputs[final_audio_node]
-                if node_output:
-                    if "audio" in node_output:
-                        audio_list = node_output["audio"]
-                        if not isinstance(audio_list, list):
-                            audio_list = [audio_list]
-                        
-                        for audio_item in audio_list:
-                            if isinstance(audio_item, dict) and "filename" in audio_item:
-                                audio_file = audio_item.get("filename", "")
-                                
-                                audio_data = self.download_output_audio(
-                                    server_address,
-                                    audio_file,
-                                    audio_item.get("subfolder", ""),
-                                    audio_item.get("type", "output")
-                                )
-                                
-                                if audio_data is not None:
-                                    output_audios.append(audio_data)
+                if not isinstance(audio_list, list):
+                    audio_list = [audio_list]
+                
+                for audio_item in audio_list:
+                    if isinstance(audio_item, dict) and "filename" in audio_item:
+                        download_jobs.append(("audio", audio_item))
+        
+        return download_jobs, output_texts
+    
+    def assemble_outputs(self, download_jobs, download_results, output_texts, options=None):
+        options = options or {}
+        output_images = []
+        output_audios = []
+        output_videos = []
+        
+        for (kind, _), result in zip(download_jobs, download_results):
+            if kind == "image":
+                if result is not None:
+                    output_images.append(result)
+            
+            elif kind == "video":
+                video_tensor, video_audio = result
+                if video_tensor is not None:
+                    output_videos.append(video_tensor)
                     
-                    elif "audios" in node_output:
-                        audios_list = node_output["audios"]
-                        if not isinstance(audios_list, list):
-                            audios_list = [audios_list]
-                        
-                        for audio_item in audios_list:
-                            if isinstance(audio_item, dict) and "filename" in audio_item:
-                                audio_file = audio_item.get("filename", "")
-                                
-                                audio_data = self.download_output_audio(
-                                    server_address,
-                                    audio_file,
-                                    audio_item.get("subfolder", ""),
-                                    audio_item.get("type", "output")
-                                )
-                                
-                                if audio_data is not None:
-                                    output_audios.append(audio_data)
-        
-        final_image = output_images[-1] if output_images else torch.zeros((1, 64, 64, 3))
+                    if video_audio is not None:
+                        output_audios.append(video_audio)
+            
+            elif kind == "audio":
+                if result is not None:
+                    output_audios.append(result)
+        
+        if output_images:
+            final_image = stack_uint8_images(output_images, options.get("output_size_policy", "resize"))
+        else:
+            final_image = torch.zeros((1, 64, 64, 3))
         final_text = output_texts[-1] if output_texts else "执行成功"
         
         if output_audios:
@@ -752,12 +3860,165 @@ class RemoteWorkflowExecutor:
         return (final_image, final_text, final_audio, final_video)
 
 
+class RemoteWorkflowSubmit(RemoteWorkflowExecutor):
+    
+    # 只上传并提交，拿到 prompt_id 后立即返回，由 RemoteWorkflowFetch 取回结果
+    RETURN_TYPES = ("REMOTE_JOB",)
+    RETURN_NAMES = ("job",)
+    FUNCTION = "submit_remote"
+    
+    def submit_remote(self, remote_ip, remote_port, workflow_file, selected_nodes, saved_state="{}", **kwargs):
+        return (remote_engine.run(
+            self.submit_remote_async(remote_ip, remote_port, workflow_file, selected_nodes, saved_state, **kwargs)
+        ),)
+    
+    async def submit_remote_async(self, remote_ip, remote_port, workflow_file, selected_nodes, saved_state="{}",
+                                  video_codec="mp4_lossless", video_fps=24.0,
+                                  batch_mode="off", batch_chunk_size=1, max_parallel_jobs=4,
+                                  image_format="auto", image_compress_level=6, output_size_policy="resize",
+                                  use_result_cache=False,
+                                  output_frame_stride=1, output_max_frames=0, output_max_side=0,
+                                  audio_format="wav", **kwargs):
+        options = self.build_options(
+            video_codec, video_fps, image_format, image_compress_level, output_size_policy,
+            use_result_cache, output_frame_stride, output_max_frames, output_max_side, audio_format
+        )
+        report = RunReport()
+        self.last_run_report = report
+        
+        try:
+            servers = parse_server_list(remote_ip, remote_port)
+            workflow, sorted_nodes = self.prepare_workflow(workflow_file, selected_nodes)
+            job_inputs = self.split_batch_inputs(kwargs, batch_chunk_size) if batch_mode == "split" else [kwargs]
+            
+            if len(job_inputs) == 1:
+                jobs = [await self.submit_job_async(servers, workflow, sorted_nodes, kwargs, options=options, report=report)]
+            else:
+                jobs = await self.submit_batch_async(
+                    servers, workflow, sorted_nodes, job_inputs, max_parallel_jobs, options, report
+                )
+        except RemoteExecutionError as e:
+            report.fail(e)
+            return RemoteJobHandle(options=options, report=report, error=str(e))
+        
+        # 取回节点不一定会执行，提交后立即归还在途计数，避免占住服务器
+        for job in jobs:
+            job.release()
+        
+        logger.info("已提交远程任务: %s", ", ".join(job.prompt_id or "cache" for job in jobs))
+        return RemoteJobHandle(jobs, options, report)
+    
+    async def submit_batch_async(self, servers, workflow, sorted_nodes, job_inputs, max_parallel_jobs, options, report):
+        semaphore = asyncio.Semaphore(max(1, int(max_parallel_jobs)))
+        
+        async def submit_chunk(index, job):
+            child = RunReport(f"batch {index + 1}/{len(job_inputs)}")
+            report.children.append(child)
+            async with semaphore:
+                try:
+                    return await self.submit_job_async(
+                        servers, WorkflowInstance(workflow, getattr(workflow, "template", None)), sorted_nodes, job,
+                        all_frames=True, options=options, report=child
+                    )
+                except BaseException as e:
+                    child.fail(e)
+                    raise
+        
+        results = await asyncio.gather(
+            *(submit_chunk(index, job) for index, job in enumerate(job_inputs)), return_exceptions=True
+        )
+        try:
+            self.check_batch_results(results)
+        except BaseException:
+            # 部分子任务提交失败时取消已经提交的部分
+            for result in results:
+                if isinstance(result, RemoteJob) and result.prompt_id:
+                    result.release()
+                    await remote_engine.call(self.cancel_remote_prompt, result.server_address, result.prompt_id)
+                    await self.update_job_store_async(result, "cancelled")
+            raise
+        return results
+
+
+class RemoteWorkflowFetch(RemoteWorkflowExecutor):
+    
+    @classmethod
+    def INPUT_TYPES(cls):
+        return {
+            "required": {
+                "job": ("REMOTE_JOB",),
+            },
+            "optional": {
+                "timeout": ("INT", {"default": 600, "min": 1, "max": 86400}),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
+            }
+        }
+    
+    FUNCTION = "fetch_remote"
+    
+    def fetch_remote(self, job, timeout=600, unique_id=None):
+        return remote_engine.run(self.fetch_remote_async(job, timeout, unique_id))
+    
+    async def fetch_remote_async(self, handle, timeout=600, progress_node=None):
+        if not isinstance(handle, RemoteJobHandle):
+            handle = RemoteJobHandle(error="无效的远程任务")
+            handle.report.fail(RemoteExecutionError(handle.error, "invalid_input"))
+        
+        report = handle.report
+        self.last_run_report = report
+        jobs = handle.jobs
+        
+        try:
+            if handle.error:
+                outputs = self.error_outputs(handle.error)
+            elif len(jobs) == 1:
+                outputs = await self.fetch_job_async(jobs[0], progress_node, timeout)
+            else:
+                outputs = await self.fetch_batch_async(jobs, handle.options, timeout, progress_node)
+        except RemoteExecutionError as e:
+            report.fail(e)
+            outputs = self.error_outputs(str(e))
+        except BaseException as e:
+            report.fail(e)
+            raise
+        finally:
+            await self.finish_report_async(report)
+        
+        return (*outputs, report.to_json())
+    
+    async def fetch_batch_async(self, jobs, options, timeout=600, progress_node=None):
+        progress = RemoteProgressForwarder(progress_node, len(jobs)) if progress_node is not None else None
+        finished = [0]
+        
+        async def fetch_chunk(job):
+            try:
+                return await self.fetch_job_async(job, timeout=timeout)
+            except BaseException as e:
+                job.report.fail(e)
+                raise
+            finally:
+                job.report.finish()
+                finished[0] += 1
+                if progress is not None:
+                    progress.update(finished[0], len(jobs))
+        
+        results = await asyncio.gather(*(fetch_chunk(job) for job in jobs), return_exceptions=True)
+        self.check_batch_results(results)
+        return self.merge_batch_outputs(results, options)
+
+
 NODE_CLASS_MAPPINGS = {
-    "RemoteWorkflowExecutor": RemoteWorkflowExecutor
+    "RemoteWorkflowExecutor": RemoteWorkflowExecutor,
+    "RemoteWorkflowSubmit": RemoteWorkflowSubmit,
+    "RemoteWorkflowFetch": RemoteWorkflowFetch,
 }
 
 NODE_DISPLAY_NAME_MAPPINGS = {
-    "RemoteWorkflowExecutor": "🐳IP Workflow"
+    "RemoteWorkflowExecutor": "🐳IP Workflow",
+    "RemoteWorkflowSubmit": "🐳IP Workflow Submit",
+    "RemoteWorkflowFetch": "🐳IP Workflow Fetch",
 }
 
 WEB_DIRECTORY = "./js"
@@ -0,0 +1,19 @@
+import os
+import sys
+import tempfile
+import types
+
+# 测试不在 ComfyUI 环境中运行：把仓库根目录加入路径，并提供节点模块导入时用到的 folder_paths 目录函数
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+try:
+    import folder_paths  # noqa: F401
+except ImportError:
+    base = tempfile.mkdtemp(prefix="pond_tests_")
+    shim = types.ModuleType("folder_paths")
+    for name in ("get_temp_directory", "get_user_directory", "get_input_directory", "get_output_directory"):
+        setattr(shim, name, lambda base=base: base)
+    sys.modules["folder_paths"] = shim
+
+# 测试中不写入用户目录下的任务记录
+os.environ.setdefault("POND_REMOTE_JOB_STORE", "")
@@ -0,0 +1,39 @@
+import json
+
+import remote_workflow_node as rwn
+
+
+def dispatch(hub, msg_type, **data):
+    hub._dispatch(json.dumps({"type": msg_type, "data": data}))
+
+
+def test_early_events_are_capped_per_prompt():
+    hub = rwn.RemoteEventHub("127.0.0.1:1")
+    dispatch(hub, "execution_start", prompt_id="p")
+    for index in range(hub.MAX_EARLY_EVENTS * 2):
+        dispatch(hub, "executing", prompt_id="p", node=str(index))
+    assert len(hub._early_events["p"]) == hub.MAX_EARLY_EVENTS
+    
+    watch = hub.watch("p")
+    assert watch.events_dropped
+    assert not hub._early_events
+
+
+def test_consecutive_progress_events_are_collapsed():
+    hub = rwn.RemoteEventHub("127.0.0.1:1")
+    dispatch(hub, "executed", prompt_id="p", node="3", output={"images": []})
+    for value in range(1000):
+        dispatch(hub, "progress", prompt_id="p", value=value, max=1000)
+    assert [event[0] for event in hub._early_events["p"]] == ["executed", "progress"]
+    
+    watch = hub.watch("p")
+    assert watch.outputs == {"3": {"images": []}}
+    assert not watch.events_dropped
+
+
+def test_stale_early_events_are_dropped(monkeypatch):
+    hub = rwn.RemoteEventHub("127.0.0.1:1")
+    dispatch(hub, "executing", prompt_id="old", node="1")
+    monkeypatch.setattr(rwn.time, "time", lambda now=rwn.time.time(): now + rwn.EVENT_HUB_IDLE + 1)
+    dispatch(hub, "executing", prompt_id="new", node="1")
+    assert list(hub._early_events) == ["new"]
@@ -0,0 +1,25 @@
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+import remote_workflow_node as rwn
+
+
+@pytest.mark.parametrize("image_format", sorted(rwn.IMAGE_UPLOAD_FORMATS))
+@pytest.mark.parametrize("channels, mode", [(1, "L"), (2, "LA"), (3, "RGB"), (4, "RGBA")])
+def test_encode_image_bytes_channels(image_format, channels, mode):
+    # 透明度取非零值：WebP 无损默认会丢弃全透明像素的颜色
+    array = np.random.default_rng(channels).integers(1, 256, (16, 24, channels), dtype=np.uint8)
+    with Image.open(io.BytesIO(rwn.encode_image_bytes(array, image_format))) as image:
+        assert image.size == (24, 16)
+        # WebP 没有灰度模式，解码后是 RGB(A)，像素仍然无损
+        decoded = np.asarray(image.convert(mode))
+    assert np.array_equal(decoded.reshape(array.shape), array)
+
+
+def test_encode_image_bytes_multi_frame_two_channels():
+    frames = np.random.default_rng(0).integers(0, 256, (3, 8, 8, 2), dtype=np.uint8)
+    with Image.open(io.BytesIO(rwn.encode_image_bytes(frames, "png"))) as image:
+        assert getattr(image, "n_frames", 1) == 3
@@ -0,0 +1,23 @@
+import threading
+
+import pytest
+import torch
+
+import remote_workflow_node as rwn
+
+pytestmark = pytest.mark.skipif(rwn.find_ffmpeg() is None, reason="ffmpeg not found")
+
+
+def test_encode_video_stream_completes():
+    chunks = list(rwn.encode_video_stream(torch.rand(4, 32, 32, 3), "mp4_lossless", 24.0))
+    assert sum(len(chunk) for chunk in chunks) > 0
+
+
+def test_encode_video_stream_closed_early_returns():
+    # 帧数足够多时 ffmpeg 会写满 stdout 管道而阻塞，提前关闭生成器也必须很快返回
+    stream = rwn.encode_video_stream(torch.rand(600, 64, 64, 3), "mp4_lossless", 24.0, chunk_size=1024)
+    next(stream)
+    closer = threading.Thread(target=stream.close, daemon=True)
+    closer.start()
+    closer.join(rwn.VIDEO_ENCODE_JOIN_TIMEOUT + 5)
+    assert not closer.is_alive()